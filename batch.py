@@ -0,0 +1,77 @@
+import io
+import os
+import glob
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from vfs import OverlayVFS
+from shell import Shell, run_headless
+
+_base_vfs = None
+_shell_options = {}
+
+
+def is_batch_target(path):
+    return os.path.isdir(path) or glob.has_magic(path)
+
+
+def collect_scripts(path):
+    if os.path.isdir(path):
+        names = sorted(os.listdir(path))
+        return [os.path.join(path, n) for n in names if os.path.isfile(os.path.join(path, n))]
+    return sorted(p for p in glob.glob(path) if os.path.isfile(p))
+
+
+def _init_worker(vfs, options):
+    global _base_vfs, _shell_options
+    if vfs is not None:
+        _base_vfs = vfs
+    _shell_options = options
+
+
+def _run_one(script_path):
+    # mv и chown меняют дерево, поэтому каждый скрипт работает со своей копией при записи
+    shell = Shell(vfs=OverlayVFS(_base_vfs) if _base_vfs is not None else None, **_shell_options)
+    out = io.StringIO()
+    start = time.perf_counter()
+    try:
+        rc = run_headless(shell, script_path, out)
+    except Exception as e:
+        print(f"Ошибка при выполнении скрипта: {e}", file=out)
+        rc = 1
+    return script_path, rc, out.getvalue(), time.perf_counter() - start
+
+
+def run_batch(vfs, pattern, out, jobs=None, **shell_options):
+    global _base_vfs, _shell_options
+    scripts = collect_scripts(pattern)
+    if not scripts:
+        print(f"Ошибка: стартовые скрипты не найдены: {pattern}", file=out)
+        return 1
+
+    jobs = jobs or os.cpu_count() or 1
+    # При fork рабочие процессы наследуют уже разобранное дерево,
+    # иначе оно один раз сериализуется в каждый процесс
+    if multiprocessing.get_start_method() == 'fork':
+        _base_vfs, _shell_options = vfs, shell_options
+        initargs = (None, shell_options)
+    else:
+        initargs = (vfs, shell_options)
+
+    start = time.perf_counter()
+    failed = 0
+    total = 0.0
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=initargs) as pool:
+        for script_path, rc, output, elapsed in pool.map(_run_one, scripts):
+            total += elapsed
+            if rc:
+                failed += 1
+            print(f"=== {script_path} (код {rc}, {elapsed:.3f} с) ===", file=out)
+            out.write(output)
+            out.flush()
+    wall = time.perf_counter() - start
+
+    print(f"=== Итого: скриптов {len(scripts)}, с ошибками {failed}, процессов {jobs} ===", file=out)
+    print(f"Общее время: {wall:.3f} с, суммарное время скриптов: {total:.3f} с", file=out)
+    return 1 if failed else 0
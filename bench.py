@@ -0,0 +1,372 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import zipfile
+
+from vfs import DirNode, FileNode, load_vfs_from_zip
+from snapshot import load_snapshot, save_snapshot
+
+
+def make_archive(path, entries, width):
+    # Дерево из каталогов по width элементов, в каждом каталоге файлы и подкаталоги
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as z:
+        count = 0
+        queue = ['root/']
+        while queue and count < entries:
+            d = queue.pop(0)
+            z.writestr(d, b'')
+            count += 1
+            for i in range(width):
+                if count >= entries:
+                    break
+                if i % 2:
+                    queue.append(f"{d}dir{i}/")
+                else:
+                    z.writestr(f"{d}file{i}.txt", b'x')
+                    count += 1
+
+
+def load_dict_tree(zip_path):
+    # Прежнее представление VFS: вложенные dict с ключом 'owner'
+    vfs = {}
+    with zipfile.ZipFile(zip_path, 'r') as z:
+        for info in z.infolist():
+            parts = info.filename.strip('/').split('/')
+            ref = vfs
+            for p in parts[:-1]:
+                if p not in ref:
+                    ref[p] = {'owner': 'user'}
+                ref = ref[p]
+            last = parts[-1]
+            if info.is_dir():
+                if last not in ref:
+                    ref[last] = {'owner': 'user'}
+            else:
+                ref[last] = {'content': z.read(info.filename), 'owner': 'user'}
+    return vfs
+
+
+def dict_lookup(vfs, parts):
+    ref = vfs
+    for p in parts:
+        if p not in ref or not isinstance(ref[p], dict) or 'content' in ref[p]:
+            raise ValueError(p)
+        ref = ref[p]
+    return ref
+
+
+def dict_listing(ref):
+    lines = []
+    for name in [k for k in ref.keys() if k != 'owner']:
+        obj = ref[name]
+        if 'content' not in obj:
+            subdirs = sum(1 for k in obj.keys() if k != 'owner' and isinstance(obj[k], dict) and 'content' not in obj[k])
+            lines.append((name, 2 + subdirs))
+        else:
+            lines.append((name, 1))
+    return lines
+
+
+def node_lookup(root, parts):
+    ref = root
+    for p in parts:
+        ref = ref.children.get(p)
+        if not isinstance(ref, DirNode):
+            raise ValueError(p)
+    return ref
+
+
+def node_listing(ref):
+    lines = []
+    for name, obj in ref.children.items():
+        if isinstance(obj, DirNode):
+            lines.append((name, 2 + sum(1 for c in obj.children.values() if isinstance(c, DirNode))))
+        else:
+            lines.append((name, 1))
+    return lines
+
+
+def dir_paths(zip_path):
+    with zipfile.ZipFile(zip_path) as z:
+        return [n.strip('/').split('/') for n in z.namelist() if n.endswith('/')]
+
+
+def measure_memory(loader, zip_path):
+    tracemalloc.start()
+    tree = loader(zip_path)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return tree, size
+
+
+def measure_time(func, tree, items, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            func(tree, item)
+    return (time.perf_counter() - start) / (repeat * len(items))
+
+
+def bench_tree_model(zip_path, repeat):
+    paths = dir_paths(zip_path)
+    dict_tree, dict_mem = measure_memory(load_dict_tree, zip_path)
+    node_tree, node_mem = measure_memory(lambda p: load_vfs_from_zip(p).root, zip_path)
+
+    dict_dirs = [dict_lookup(dict_tree, p) for p in paths]
+    node_dirs = [node_lookup(node_tree, p) for p in paths]
+
+    rows = [
+        ("память, байт", dict_mem, node_mem),
+        ("поиск пути, мкс", measure_time(dict_lookup, dict_tree, paths, repeat) * 1e6,
+         measure_time(node_lookup, node_tree, paths, repeat) * 1e6),
+        ("ls -l каталога, мкс", measure_time(lambda t, d: dict_listing(d), None, dict_dirs, repeat) * 1e6,
+         measure_time(lambda t, d: node_listing(d), None, node_dirs, repeat) * 1e6),
+    ]
+    print(f"{'':24}{'dict':>14}{'DirNode/FileNode':>20}")
+    for title, old, new in rows:
+        print(f"{title:24}{old:>14.1f}{new:>20.1f}")
+
+
+def bench_snapshot(zip_path, snap_path):
+    rows = []
+    for lazy in (False, True):
+        start = time.perf_counter()
+        vfs = load_vfs_from_zip(zip_path, lazy=lazy)
+        rows.append((f"load_vfs_from_zip{' --lazy' if lazy else ''}, с", time.perf_counter() - start))
+        save_snapshot(vfs, snap_path)
+        del vfs
+        start = time.perf_counter()
+        load_snapshot(snap_path)
+        rows.append((f"load_snapshot{' (ссылки на ZIP)' if lazy else ''}, с", time.perf_counter() - start))
+    for title, value in rows:
+        print(f"{title:36}{value:>10.3f}")
+
+
+def bench_typing(lines, keys):
+    # Требует Kivy: замер нажатий клавиш в терминале с длинной историей вывода
+    os.environ.setdefault('KIVY_NO_ARGS', '1')
+    from terminal import Terminal
+
+    term = Terminal(scrollback=lines)
+    term._write("\n".join(f"line {i}" for i in range(lines)))
+    term._show_prompt()
+
+    rows = []
+    start = time.perf_counter()
+    for _ in range(keys):
+        term.insert_text('a')
+    rows.append(("ввод символа, мс", (time.perf_counter() - start) / keys * 1e3))
+
+    start = time.perf_counter()
+    for _ in range(keys):
+        term.do_backspace()
+    rows.append(("backspace, мс", (time.perf_counter() - start) / keys * 1e3))
+
+    start = time.perf_counter()
+    for _ in range(keys):
+        term._get_input_line()
+    rows.append(("чтение строки ввода, мс", (time.perf_counter() - start) / keys * 1e3))
+
+    print(f"Строк вывода в терминале: {lines}")
+    for title, value in rows:
+        print(f"{title:28}{value:>10.3f}")
+
+
+def make_deep(path, scale):
+    # Цепочка вложенных каталогов с небольшим файлом на каждом уровне
+    depth = max(2, int(500 * scale))
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        prefix = ''
+        for i in range(depth):
+            prefix += f"d{i}/"
+            z.writestr(prefix, b'')
+            z.writestr(f"{prefix}file.txt", f"level {i}\n".encode())
+
+
+def make_wide(path, scale):
+    # Один каталог с большим числом файлов и подкаталогов
+    width = max(4, int(20000 * scale))
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('wide/', b'')
+        for i in range(width):
+            if i % 10 == 0:
+                z.writestr(f"wide/dir{i}/", b'')
+            else:
+                z.writestr(f"wide/file{i}.txt", f"file {i}\n".encode())
+
+
+def make_tiny(path, scale):
+    make_archive(path, max(10, int(100000 * scale)), 20)
+
+
+def make_huge(path, scale):
+    # Несколько больших текстовых файлов
+    rng = random.Random(17)
+    lines = max(100, int(400000 * scale))
+    words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta']
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('huge/', b'')
+        z.writestr('huge/other/', b'')
+        for i in range(4):
+            text = "\n".join(' '.join(rng.choice(words) for _ in range(6)) for _ in range(lines))
+            z.writestr(f"huge/big{i}.txt", text.encode())
+
+
+SHAPES = {'deep': make_deep, 'wide': make_wide, 'tiny': make_tiny, 'huge': make_huge}
+
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_shape(zip_path, repeat):
+    from shell import Shell, run_headless
+
+    results = {}
+
+    def record(name, seconds, ops):
+        results[name] = {'seconds': seconds, 'ops': ops, 'us_per_op': seconds / ops * 1e6}
+
+    record('load', best_time(lambda: load_vfs_from_zip(zip_path), repeat), 1)
+    record('load_lazy', best_time(lambda: load_vfs_from_zip(zip_path, lazy=True), repeat), 1)
+    threads = max(2, os.cpu_count() or 1)
+    record('load_threads', best_time(lambda: load_vfs_from_zip(zip_path, threads=threads), repeat), 1)
+
+    vfs = load_vfs_from_zip(zip_path)
+    dirs = sorted(p for p, n in vfs.index.items() if isinstance(n, DirNode) and p != '/')
+    files = sorted(p for p, n in vfs.index.items() if isinstance(n, FileNode))
+    shell = Shell(vfs)
+
+    record('resolve', best_time(lambda: [shell._resolve_path(d) for d in dirs], repeat), len(dirs))
+    record('ls', best_time(lambda: [shell.cmd_ls([d]) for d in dirs], repeat), len(dirs))
+    record('ls_l', best_time(lambda: [shell.cmd_ls(['-l', d]) for d in dirs], repeat), len(dirs))
+    record('chown', best_time(lambda: [shell.cmd_chown(['bench', f]) for f in files], repeat), len(files))
+
+    # Файл перемещается между двумя каталогами туда и обратно
+    src_dir, _, name = files[0].rpartition('/')
+    dst_dir = dirs[0] if dirs[0] != src_dir else dirs[-1]
+    moves = 100
+
+    def move_back_and_forth():
+        path = files[0]
+        for i in range(moves):
+            target = dst_dir if i % 2 == 0 else src_dir
+            shell.cmd_mv([path, target + '/'])
+            path = f"{target}/{name}"
+
+    if src_dir != dst_dir:
+        record('mv', best_time(move_back_and_forth, repeat), moves)
+
+    def rev_all():
+        for f in files:
+            for _ in shell.cmd_rev([f]):
+                pass
+
+    record('rev', best_time(rev_all, repeat), len(files))
+
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as script:
+        for d in dirs[:2000]:
+            script.write(f"cd {d}\nls -l\ncd\n")
+        script_path = script.name
+    try:
+        record('script', best_time(lambda: run_headless(Shell(load_vfs_from_zip(zip_path)), script_path,
+                                                        io.StringIO()), repeat), 3 * len(dirs[:2000]))
+    finally:
+        os.remove(script_path)
+    return results
+
+
+def run_suite(shapes, scale, repeat):
+    report = {
+        'meta': {'python': platform.python_version(), 'platform': platform.platform(),
+                 'scale': scale, 'repeat': repeat},
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for shape in shapes:
+            zip_path = os.path.join(tmp, f"{shape}.zip")
+            SHAPES[shape](zip_path, scale)
+            print(f"{shape}: {os.path.getsize(zip_path)} байт", file=sys.stderr)
+            for name, value in bench_shape(zip_path, repeat).items():
+                report['results'][f"{shape}.{name}"] = value
+    return report
+
+
+def compare(report, baseline, threshold, out=sys.stdout):
+    # Регрессия — рост времени на операцию больше чем на threshold
+    regressions = []
+    print(f"{'замер':20}{'было, мкс':>14}{'стало, мкс':>14}{'изменение':>12}", file=out)
+    for name, value in report['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            print(f"{name:20}{'-':>14}{value['us_per_op']:>14.2f}{'новый':>12}", file=out)
+            continue
+        ratio = value['us_per_op'] / old['us_per_op'] if old['us_per_op'] else 1.0
+        mark = ' !' if ratio > 1 + threshold else ''
+        print(f"{name:20}{old['us_per_op']:>14.2f}{value['us_per_op']:>14.2f}{(ratio - 1) * 100:>+11.1f}%{mark}",
+              file=out)
+        if mark:
+            regressions.append(name)
+    if regressions:
+        print(f"Регрессии (>{threshold * 100:.0f}%): {', '.join(regressions)}", file=out)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Сравнение представлений дерева VFS')
+    parser.add_argument('--entries', type=int, default=100000, help='Число элементов в архиве')
+    parser.add_argument('--width', type=int, default=20, help='Число элементов в каталоге')
+    parser.add_argument('--repeat', type=int, default=3, help='Число повторов замеров времени')
+    parser.add_argument('--typing', type=int, default=0, metavar='LINES',
+                        help='Замерить ввод в терминале с LINES строками вывода (нужен Kivy)')
+    parser.add_argument('--snapshot', action='store_true', help='Сравнить загрузку ZIP и снимка VFS')
+    parser.add_argument('--suite', action='store_true',
+                        help='Набор замеров загрузчика и команд на синтетических архивах разной формы')
+    parser.add_argument('--shapes', default=','.join(SHAPES), help='Формы архивов для --suite через запятую')
+    parser.add_argument('--scale', type=float, default=1.0, help='Множитель размера архивов для --suite')
+    parser.add_argument('--json', type=str, default=None, help='Записать результаты --suite в JSON-файл')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON с прошлыми результатами для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Допустимое замедление при сравнении (доля)')
+    args = parser.parse_args()
+
+    if args.typing:
+        bench_typing(args.typing, 50)
+        sys.exit(0)
+
+    if args.suite:
+        report = run_suite(args.shapes.split(','), args.scale, args.repeat)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+        else:
+            json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+            print()
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            # Без --json в stdout уже лежит JSON, таблица сравнения уходит в stderr
+            out = sys.stdout if args.json else sys.stderr
+            sys.exit(1 if compare(report, baseline, args.threshold, out) else 0)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        zip_path = os.path.join(tmp, 'bench.zip')
+        make_archive(zip_path, args.entries, args.width)
+        print(f"Архив: {args.entries} элементов, {os.path.getsize(zip_path)} байт", file=sys.stderr)
+        if args.snapshot:
+            bench_snapshot(zip_path, os.path.join(tmp, 'bench.snap'))
+        else:
+            bench_tree_model(zip_path, args.repeat)
@@ -0,0 +1,148 @@
+import os
+import mmap
+import threading
+from bisect import bisect_left
+
+# Файл истории: по строке на команду, первый символ — откуда она пришла
+TAG_TYPED = 'c'
+TAG_SCRIPT = 's'
+# При превышении размера файл переименовывается в <файл>.1, прежний .1 удаляется
+HISTORY_MAX_BYTES = 8 * 1024 * 1024
+DEFAULT_HISTORY_FILE = os.path.join(os.path.expanduser('~'), '.vfs_emulator_history')
+
+
+def _read_typed(path, entries):
+    # Строки читаются из mmap по одной, декодируются только набранные команды
+    prefix = (TAG_TYPED + ' ').encode()
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for line in iter(mm.readline, b''):
+                    if line.startswith(prefix):
+                        entries.append(line[2:].rstrip(b'\n').decode('utf-8', 'replace'))
+    except OSError:
+        pass
+
+
+def _grams(line):
+    return {line[i:i + 3] for i in range(len(line) - 2)}
+
+
+class CommandHistory:
+    # Набранные команды доступны по номерам (0 — самая старая). Файл читается в фоновом потоке,
+    # там же строится индекс триграмм для Ctrl-R: триграмма -> возрастающий список номеров команд.
+    # Строки, добавленные до окончания чтения, откладываются: номера команд не сдвигаются,
+    # а файл не дописывается, пока его читает фоновый поток
+    def __init__(self, path=None, max_bytes=HISTORY_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.entries = []
+        self._pending = []
+        self._loaded = False
+        self.postings = None
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+        self._file = None
+        if not path:
+            # Без файла история хранится только в памяти
+            self._loaded = True
+            return
+        try:
+            self._file = open(path, 'ab')
+        except OSError:
+            pass
+
+    def start(self):
+        threading.Thread(target=self._build, name='history-index', daemon=True).start()
+        return self
+
+    def _build(self):
+        entries = []
+        if self.path:
+            _read_typed(self.path + '.1', entries)
+            _read_typed(self.path, entries)
+        with self._lock:
+            self.entries = entries
+            self._flush_pending()
+        postings = {}
+        count = len(entries)
+        for i in range(count):
+            self._index(postings, i)
+        with self._lock:
+            # Команды, добавленные во время построения, индексируются здесь
+            for i in range(count, len(self.entries)):
+                self._index(postings, i)
+            self.postings = postings
+        self.ready.set()
+
+    def _index(self, postings, i):
+        for gram in _grams(self.entries[i]):
+            postings.setdefault(gram, []).append(i)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, i):
+        return self.entries[i]
+
+    def _flush_pending(self):
+        for line, tag in self._pending:
+            if tag == TAG_TYPED:
+                self.entries.append(line)
+            self._write(line, tag)
+        self._pending = []
+        self._loaded = True
+
+    def append(self, line, tag=TAG_TYPED):
+        with self._lock:
+            if not self._loaded:
+                self._pending.append((line, tag))
+                return
+            if tag == TAG_TYPED:
+                self.entries.append(line)
+                if self.postings is not None:
+                    self._index(self.postings, len(self.entries) - 1)
+            self._write(line, tag)
+
+    def _write(self, line, tag):
+        if self._file is None:
+            return
+        record = f"{tag} {line}\n".encode('utf-8')
+        try:
+            if self._file.tell() and self._file.tell() + len(record) > self.max_bytes:
+                self._file.close()
+                os.replace(self.path, self.path + '.1')
+                self._file = open(self.path, 'ab')
+            self._file.write(record)
+            self._file.flush()
+        except OSError:
+            self._file = None
+
+    def search(self, query, before=None):
+        # Номер самой новой команды старше before, содержащей query; None — не найдено
+        if before is None:
+            before = len(self.entries)
+        postings = self.postings
+        if len(query) < 3 or postings is None:
+            # Короткий запрос или индекс ещё строится: просмотр от новых к старым
+            for i in range(before - 1, -1, -1):
+                if query in self.entries[i]:
+                    return i
+            return None
+        # Кандидаты берутся из самого короткого списка триграмм запроса и проверяются подстрокой
+        ids = min((postings.get(gram, ()) for gram in _grams(query)), key=len)
+        for pos in range(bisect_left(ids, before) - 1, -1, -1):
+            i = ids[pos]
+            if query in self.entries[i]:
+                return i
+        return None
+
+    def close(self):
+        with self._lock:
+            if not self._loaded:
+                self._flush_pending()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
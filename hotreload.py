@@ -0,0 +1,119 @@
+import zipfile
+
+from vfs import ContentCache, DirNode, FileNode, ZipMember, ZipSource, load_vfs_from_zip, source_stat, zip_owner
+
+
+def _archive_entries(infos):
+    # Записи архива так же, как их видит загрузчик: явные записи и неявные каталоги (CRC None)
+    entries = {}
+    for name, info in infos.items():
+        parts = name.strip('/').split('/')
+        for depth in range(1, len(parts)):
+            entries.setdefault('/'.join(parts[:depth]) + '/', None)
+        entries[name] = info
+    return entries
+
+
+def _parent_entry(name):
+    stripped = name.rstrip('/')
+    return stripped[:stripped.rfind('/') + 1]
+
+
+def apply_zip_changes(vfs, lazy=False, cache_size=0):
+    # Сравнивает новый архив с загруженным по именам, CRC и размерам и меняет в дереве только
+    # отличающиеся записи. Узлы записей хранятся в vfs.zip_entries, их текущие пути — в
+    # vfs.path_of, поэтому локальные mv и chown сохраняются без повторного обхода дерева
+    zip_path = vfs.source
+    stat = source_stat(zip_path)
+    old = vfs.zip_entries
+    stats = {'added': 0, 'changed': 0, 'removed': 0, 'conflicts': 0}
+    source = None
+    if lazy:
+        source = ZipSource(zip_path, ContentCache(cache_size) if cache_size > 0 else None)
+
+    with zipfile.ZipFile(zip_path, 'r') as z:
+        infos = {info.filename: info for info in z.infolist()}
+        new = _archive_entries(infos)
+        entries = {}
+
+        def content(info):
+            return ZipMember(source, info) if lazy else z.read(info)
+
+        # Сначала удаляются вложенные записи; каталог удаляется, только если опустел
+        removed = sorted((name for name in old if name not in new),
+                         key=lambda name: -name.rstrip('/').count('/'))
+        for name in removed:
+            crc, _, node = old[name]
+            parts = vfs.path_of(node)
+            if not parts or (isinstance(node, DirNode) and node.children):
+                continue
+            vfs.remove_node(parts[:-1], parts[-1])
+            if crc is not None:
+                stats['removed'] += 1
+
+        added = []
+        for name, info in new.items():
+            entry = old.get(name)
+            if entry is None:
+                added.append(name)
+                continue
+            node = entry[2]
+            entries[name] = (None, 0, node) if info is None else (info.CRC, info.file_size, node)
+            if info is None or info.is_dir() or not isinstance(node, FileNode):
+                continue
+            if entry[:2] != (info.CRC, info.file_size):
+                parts = vfs.path_of(node)
+                if parts is not None:
+                    vfs.set_content(parts, content(info))
+                    stats['changed'] += 1
+            elif lazy and isinstance(node.content, ZipMember):
+                # Смещения в новом архиве другие: неизменённые файлы переводятся на новый ZipSource
+                node.content = ZipMember(source, info)
+
+        # Родительский каталог записи всегда обрабатывается раньше неё
+        added.sort(key=lambda name: name.rstrip('/').count('/'))
+        for name in added:
+            info = new[name]
+            parent = entries.get(_parent_entry(name)) if _parent_entry(name) else (None, 0, vfs.root)
+            parent_parts = vfs.path_of(parent[2]) if parent is not None else None
+            if parent_parts is None or not isinstance(parent[2], DirNode):
+                stats['conflicts'] += 1
+                continue
+            last = name.rstrip('/').rpartition('/')[2]
+            existing = parent[2].children.get(last)
+            if info is None or info.is_dir():
+                if existing is None:
+                    owner = zip_owner(info.extra) if info is not None and info.extra else 'user'
+                    existing = DirNode(owner)
+                    vfs.add_node(parent_parts, last, existing)
+                    if info is not None:
+                        stats['added'] += 1
+                elif not isinstance(existing, DirNode):
+                    stats['conflicts'] += 1
+                    continue
+                entries[name] = (None, 0, existing) if info is None else (info.CRC, info.file_size, existing)
+            elif existing is None:
+                node = FileNode(content(info), zip_owner(info.extra) if info.extra else 'user')
+                vfs.add_node(parent_parts, last, node)
+                entries[name] = (info.CRC, info.file_size, node)
+                stats['added'] += 1
+            elif isinstance(existing, FileNode):
+                vfs.set_content(parent_parts + (last,), content(info))
+                entries[name] = (info.CRC, info.file_size, existing)
+                stats['changed'] += 1
+            else:
+                stats['conflicts'] += 1
+
+    if vfs.zip_source is not None:
+        vfs.zip_source.close()
+    vfs.zip_source = source
+    vfs.zip_entries = entries
+    vfs.source_stat = stat
+    return stats
+
+
+def reload_vfs(vfs, lazy=False, cache_size=0):
+    # Возвращает (vfs, статистика); VFS без записей архива (из снимка) загружается заново
+    if vfs.zip_entries is None:
+        return load_vfs_from_zip(vfs.source, lazy=lazy, cache_size=cache_size), None
+    return vfs, apply_zip_changes(vfs, lazy=lazy, cache_size=cache_size)
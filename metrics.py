@@ -0,0 +1,50 @@
+# Верхние границы интервалов гистограммы задержек, мс
+LATENCY_BUCKETS = (0.1, 1, 10, 100, 1000)
+
+
+class CommandStats:
+    __slots__ = ('count', 'total', 'max', 'nodes', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.nodes = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, elapsed, nodes):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.nodes += nodes
+        ms = elapsed * 1000
+        i = 0
+        while i < len(LATENCY_BUCKETS) and ms > LATENCY_BUCKETS[i]:
+            i += 1
+        self.buckets[i] += 1
+
+    def histogram(self):
+        labels = [f"≤{b:g} мс" for b in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]:g} мс"]
+        return ", ".join(f"{label}: {n}" for label, n in zip(labels, self.buckets) if n)
+
+
+class Metrics:
+    # Сводка по командам: число вызовов, задержки и узлы, пройденные при разрешении путей
+    def __init__(self):
+        self.commands = {}
+
+    def record(self, cmd, elapsed, nodes):
+        stats = self.commands.get(cmd)
+        if stats is None:
+            stats = self.commands[cmd] = CommandStats()
+        stats.add(elapsed, nodes)
+
+    def format(self):
+        if not self.commands:
+            return "Статистика пуста: команды ещё не выполнялись"
+        lines = [f"{'команда':16}{'вызовов':>9}{'всего, мс':>12}{'среднее, мс':>13}{'макс, мс':>11}{'узлов':>9}"]
+        for cmd, stats in sorted(self.commands.items(), key=lambda item: -item[1].total):
+            lines.append(f"{cmd:16}{stats.count:>9}{stats.total * 1000:>12.2f}"
+                         f"{stats.total / stats.count * 1000:>13.3f}{stats.max * 1000:>11.3f}{stats.nodes:>9}")
+            lines.append(f"  {stats.histogram()}")
+        return "\n".join(lines)
@@ -0,0 +1,84 @@
+import os
+import asyncio
+from itertools import islice
+
+from vfs import OverlayVFS
+from shell import Shell
+
+# Сколько порций вывода команды забирается из рабочего потока за один раз
+OUTPUT_BATCH = 256
+SERVER_VFS_NOT_LOADED = "Внимание! VFS не загружена: запустите сервер с --vfs-path или --vfs-snapshot"
+
+
+class Session:
+    def __init__(self, base_vfs, shell_options):
+        vfs = OverlayVFS(base_vfs) if base_vfs is not None else None
+        # Клиенты не должны читать и перезаписывать файлы хоста от имени сервера
+        self.shell = Shell(vfs=vfs, host_files=False, **shell_options)
+        self.history = []
+
+    def run(self, line):
+        if line == "history":
+            return iter([f"{i} {cmd}" for i, cmd in enumerate(self.history, 1)])
+        return self.shell.stream_line(line)
+
+
+async def handle_session(reader, writer, base_vfs, shell_options, sessions):
+    loop = asyncio.get_running_loop()
+    session = Session(base_vfs, shell_options)
+    sessions.add(session)
+    try:
+        if not session.shell.vfs_loaded:
+            writer.write((SERVER_VFS_NOT_LOADED + "\n").encode('utf-8'))
+        while not session.shell.exit_requested:
+            writer.write(session.shell.prompt.encode('utf-8'))
+            await writer.drain()
+            data = await reader.readline()
+            if not data:
+                break
+            line = data.decode('utf-8', 'replace').strip()
+            if not line:
+                continue
+            session.history.append(line)
+
+            # Команда выполняется в пуле потоков, чтобы долгий grep -r не блокировал другие сессии;
+            # вывод пересылается пачками по мере готовности
+            output = session.run(line)
+            while True:
+                chunks = await loop.run_in_executor(None, lambda: list(islice(output, OUTPUT_BATCH)))
+                if not chunks:
+                    break
+                writer.write(("\n".join(chunks) + "\n").encode('utf-8'))
+                await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        sessions.discard(session)
+        writer.close()
+
+
+async def serve(base_vfs, address, shell_options, out):
+    sessions = set()
+
+    def on_connect(reader, writer):
+        return handle_session(reader, writer, base_vfs, shell_options, sessions)
+
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        server = await asyncio.start_server(on_connect, host or '127.0.0.1', int(port))
+    else:
+        if os.path.exists(address):
+            os.remove(address)
+        server = await asyncio.start_unix_server(on_connect, address)
+    print(f"Сервер эмулятора слушает {address}", file=out)
+    out.flush()
+    async with server:
+        await server.serve_forever()
+
+
+def run_server(base_vfs, address, out, **shell_options):
+    try:
+        asyncio.run(serve(base_vfs, address, shell_options, out))
+    except KeyboardInterrupt:
+        pass
+    return 0
@@ -0,0 +1,891 @@
+import os
+import re
+import codecs
+import socket
+import calendar
+import datetime
+import zipfile
+import cProfile
+from time import perf_counter
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from vfs import (DirNode, FileNode, OverlayVFS, PathError, join_path, load_vfs_from_zip,
+                 node_size, path_str, source_stat)
+from snapshot import load_snapshot, save_snapshot
+from zipsave import save_vfs_to_zip
+from hotreload import reload_vfs
+from textindex import TrigramIndex, required_literals
+from metrics import Metrics
+
+VFS_NOT_LOADED_WARNING = "Внимание! VFS не загружена. Введите команду:\nloadvfs <путь к ZIP> или exit"
+
+HEAD_DEFAULT_LINES = 10
+COMMANDS = ('cal', 'cd', 'chown', 'du', 'exit', 'find', 'grep', 'head', 'loadsnap', 'loadvfs', 'ls', 'mv',
+            'rev', 'savesnap', 'savevfs', 'stats', 'time', 'wc')
+# Команды, читающие или записывающие файлы хоста; в сессиях сервера отключены
+HOST_PATH_COMMANDS = ('loadsnap', 'loadvfs', 'savesnap', 'savevfs')
+COMPLETION_LIMIT = 200
+GREP_WORKERS = 8
+# Сколько файлов grep -r держит в работе одновременно
+GREP_WINDOW = GREP_WORKERS * 4
+LINE_BREAKS = '\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+
+
+def expand_env_vars_system(token: str) -> str:
+    def replacer(match):
+        var = match.group(1)
+        return os.environ.get(var, match.group(0))
+    return re.sub(r'\$([A-Za-z_][A-Za-z0-9_]*)', replacer, token)
+
+
+def read_script(script_path):
+    with open(script_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            yield line
+
+
+def iter_text_lines(chunks):
+    # Построчное декодирование UTF-8 по мере чтения, границы строк как у str.splitlines
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    tail = ''
+    for chunk in chunks:
+        text = tail + decoder.decode(chunk)
+        if not text:
+            continue
+        lines = text.splitlines()
+        if text[-1] == '\r':
+            # \r\n может оказаться на стыке порций
+            tail = lines.pop() + '\r'
+        elif text[-1] not in LINE_BREAKS:
+            tail = lines.pop()
+        else:
+            tail = ''
+        yield from lines
+    yield from (tail + decoder.decode(b'', final=True)).splitlines()
+
+
+def count_chunks(chunks):
+    lines = words = size = 0
+    in_word = False
+    for chunk in chunks:
+        if not chunk:
+            continue
+        size += len(chunk)
+        lines += chunk.count(b'\n')
+        parts = chunk.split()
+        words += len(parts)
+        if in_word and parts and not chunk[:1].isspace():
+            # Слово продолжается из предыдущей порции
+            words -= 1
+        in_word = not chunk[-1:].isspace()
+    return lines, words, size
+
+
+def grep_lines(regex, lines, flags, prefix=None):
+    invert = 'v' in flags
+    count = 0
+    for number, line in enumerate(lines, 1):
+        if (regex.search(line) is not None) == invert:
+            continue
+        count += 1
+        if 'c' not in flags:
+            if 'n' in flags:
+                line = f"{number}:{line}"
+            yield f"{prefix}:{line}" if prefix else line
+    if 'c' in flags:
+        yield f"{prefix}:{count}" if prefix else str(count)
+
+
+def unquote(token):
+    # Кавычки вокруг шаблона снимаются, как это сделала бы оболочка
+    if len(token) > 1 and token[0] == token[-1] and token[0] in '\'"':
+        return token[1:-1]
+    return token
+
+
+def scan_file(regex, flags, node, name):
+    # node=None — файл заведомо не содержит совпадений, для -c выводится 0
+    lines = () if node is None else iter_text_lines(node.chunks())
+    try:
+        return list(grep_lines(regex, lines, flags, name))
+    except UnicodeDecodeError:
+        return None
+
+
+def split_flags(args):
+    flags = ''
+    while args and args[0].startswith('-') and len(args[0]) > 1:
+        flags += args[0][1:]
+        args = args[1:]
+    return flags, args
+
+
+def format_dedup(vfs):
+    store = vfs.dedup if vfs is not None else None
+    if store is None or not store.duplicates:
+        return ""
+    return (f"Дедупликация: {store.duplicates} из {store.files} файлов совпали с уже загруженными, "
+            f"сэкономлено {store.saved} байт")
+
+
+def format_script_timings(total, timings):
+    stats = {}
+    for cmd, elapsed in timings:
+        count, spent = stats.get(cmd, (0, 0.0))
+        stats[cmd] = (count + 1, spent + elapsed)
+    lines = [f"Скрипт выполнен за {total:.3f} с, команд: {len(timings)}"]
+    for cmd, (count, spent) in sorted(stats.items(), key=lambda item: -item[1][1]):
+        lines.append(f"  {cmd}: {count} раз, всего {spent * 1000:.2f} мс, в среднем {spent / count * 1000:.3f} мс")
+    return "\n".join(lines)
+
+
+class Shell:
+    def __init__(self, vfs=None, lazy=False, cache_size=0, autosave=None, text_index=False, profile=None,
+                 watch=None, host_files=True):
+        self.vfs = vfs
+        self.vfs_loaded = vfs is not None
+        self.current_dir = []
+        self.lazy = lazy
+        self.cache_size = cache_size
+        # autosave: путь к ZIP или True для записи обратно в исходный архив
+        self.autosave = autosave
+        self.text_index = text_index
+        self._trigrams = None
+        self._trigram_index()
+        # profile: True или путь к файлу профиля стартового скрипта
+        self.profile = profile
+        self.metrics = Metrics() if profile else None
+        # watch: интервал в секундах, с которым проверяется, не изменился ли архив на диске
+        self.watch = watch
+        self._reload_checked = perf_counter()
+        # host_files=False запрещает команды с путями хоста (HOST_PATH_COMMANDS)
+        self.host_files = host_files
+
+        self.username = os.getenv("USERNAME") or os.getenv("USER") or "user"
+        self.hostname = socket.gethostname()
+        self.prompt = f"{self.username}@{self.hostname}:~$ "
+
+        self.on_exit = None
+        self.exit_requested = False
+
+    def _get_vfs_ref(self, path=None):
+        if path is None:
+            path = self.current_dir
+        return self.vfs.get(path)
+
+    def _resolve_path(self, target):
+        try:
+            path, ref = self.vfs.resolve(tuple(self.current_dir), target)
+        except PathError as e:
+            if e.component is None:
+                raise ValueError(f"cd: {target}: невозможно подняться выше корня")
+            raise ValueError(f"cd: {e.component}: нет такого каталога")
+        return list(path)
+
+    def _split_target(self, target):
+        if target.startswith('/'):
+            head, _, name = target.strip('/').rpartition('/')
+            return '/' + head, name
+        head, _, name = target.rpartition('/')
+        return head, name
+
+    def _resolve_path_and_parent(self, target):
+        head, name = self._split_target(target)
+        try:
+            parent_path, parent_ref = self.vfs.resolve(tuple(self.current_dir), head)
+        except PathError:
+            raise FileNotFoundError(f"{target}: нет такого файла или каталога")
+
+        if not name:
+            raise FileNotFoundError("Пустое имя")
+
+        if name not in parent_ref.children:
+            raise FileNotFoundError(f"{target}: нет такого файла или каталога")
+
+        obj = parent_ref.children[name]
+        return parent_path, name, obj
+
+    def cmd_cd(self, args):
+        if not self.vfs_loaded:
+            return "Ошибка: VFS не загружена. Используйте loadvfs <zip> или exit"
+        if not args:
+            self.current_dir = []
+        else:
+            try:
+                self.current_dir = self._resolve_path(args[0])
+            except ValueError as e:
+                return str(e)
+        self.update_prompt()
+        return ""
+
+    def _format_long(self, name, obj):
+        if isinstance(obj, DirNode):
+            return f"drw-r--r-- {2 + obj.ndirs} {obj.owner} 0 {name}"
+        return f"-rw-r--r-- 1 {obj.owner} {obj.size} {name}"
+
+    def _list_dir(self, ref, long_format):
+        if long_format:
+            return "\n".join(self._format_long(name, obj) for name, obj in ref.children.items())
+        return "  ".join(ref.children)
+
+    def cmd_ls(self, args):
+        if not self.vfs_loaded:
+            return "Ошибка: VFS не загружена. Используйте loadvfs <zip> или exit"
+
+        use_system_env = False
+        long_format = False
+        if args and args[0] == "-s":
+            use_system_env = True
+            args = args[1:]
+        elif args and args[0] == "-l":
+            long_format = True
+            args = args[1:]
+
+        if not args:
+            return self._list_dir(self._get_vfs_ref(), long_format)
+
+        outputs = []
+        for tok in args:
+            if use_system_env:
+                tok = expand_env_vars_system(tok)
+
+            try:
+                _, ref = self.vfs.resolve(tuple(self.current_dir), tok)
+                outputs.append(f"{tok}:\n" + self._list_dir(ref, long_format))
+                continue
+            except PathError:
+                pass
+
+            try:
+                _, name, item = self._resolve_path_and_parent(tok)
+            except FileNotFoundError:
+                outputs.append(f"ls: {tok}: нет такого файла или каталога")
+                continue
+            if long_format:
+                outputs.append(self._format_long(name, item))
+            else:
+                outputs.append(tok)
+
+        return "\n".join(outputs)
+
+    def cmd_mv(self, args):
+        if len(args) != 2:
+            return "mv: требуется два аргумента: <источник> <назначение>"
+
+        src, dst = args
+
+        try:
+            src_parent, src_name, src_obj = self._resolve_path_and_parent(src)
+        except FileNotFoundError as e:
+            return f"mv: {e}"
+
+        cwd = tuple(self.current_dir)
+        dst_parent = None
+        dst_head, _, dst_name = dst.rstrip('/').rpartition('/')
+        if dst.endswith('/') or dst_name in ('', '.', '..'):
+            # Путь вида 'каталог/' означает перемещение внутрь каталога под прежним именем
+            try:
+                dst_parent, dst_ref = self.vfs.resolve(cwd, dst, clamp=True)
+                dst_name = src_name
+            except PathError:
+                if dst_name in ('', '.', '..'):
+                    return f"mv: невозможно создать '{dst}': нет такого каталога"
+        if dst_parent is None:
+            if dst.startswith('/') and not dst_head:
+                dst_head = '/'
+            try:
+                dst_parent, dst_ref = self.vfs.resolve(cwd, dst_head, clamp=True)
+            except PathError:
+                return f"mv: невозможно создать '{dst}': нет такого каталога"
+
+        src_path = src_parent + (src_name,)
+        if dst_parent[:len(src_path)] == src_path:
+            return f"mv: невозможно переместить '{src}' в собственный подкаталог"
+
+        if isinstance(dst_ref.children.get(dst_name), FileNode):
+            return f"mv: невозможно переименовать '{dst}': файл существует"
+
+        if dst_name in dst_ref.children:
+            return f"mv: '{dst}' существует"
+
+        self.vfs.move(src_parent, src_name, dst_parent, dst_name)
+        if tuple(self.current_dir[:len(src_path)]) == src_path:
+            # Текущий каталог переехал вместе с перемещённым поддеревом
+            self.current_dir = list(dst_parent) + [dst_name] + self.current_dir[len(src_path):]
+            self.update_prompt()
+        return ""
+
+    def cmd_chown(self, args):
+        if len(args) != 2:
+            return "chown: требуется два аргумента: <пользователь> <файл|каталог>"
+
+        new_owner, target = args
+
+        try:
+            parent, name, obj = self._resolve_path_and_parent(target)
+        except FileNotFoundError as e:
+            return f"chown: {e}"
+
+        # Обновляем владельца объекта (файл или каталог)
+        self.vfs.chown(parent + (name,), new_owner)
+        return ""
+
+    def _open_file(self, cmd, arg):
+        try:
+            _, _, obj = self._resolve_path_and_parent(arg)
+        except FileNotFoundError:
+            return None, f"{cmd}: {arg}: нет такого файла или каталога"
+        if not isinstance(obj, FileNode):
+            return None, f"{cmd}: {arg}: это каталог"
+        return obj, None
+
+    def cmd_rev(self, args, stdin=None):
+        if not args:
+            if stdin is None:
+                yield "rev: не указаны аргументы"
+                return
+            for line in stdin:
+                yield line[::-1]
+            return
+
+        for arg in args:
+            try:
+                _, _, obj = self._resolve_path_and_parent(arg)
+            except FileNotFoundError:
+                yield arg[::-1]
+                continue
+            if not isinstance(obj, FileNode):
+                yield f"rev: {arg}: это каталог"
+                continue
+            # Файл декодируется порциями, вывод начинается до чтения всего содержимого
+            empty = True
+            try:
+                for line in iter_text_lines(obj.chunks()):
+                    empty = False
+                    yield line[::-1]
+            except UnicodeDecodeError:
+                yield f"rev: {arg}: бинарный файл"
+                continue
+            if empty:
+                yield f"rev: {arg}: файл пуст"
+
+    def cmd_head(self, args, stdin=None):
+        count = HEAD_DEFAULT_LINES
+        value = None
+        if args and args[0] == '-n' and len(args) > 1:
+            value, args = args[1], args[2:]
+        elif args and args[0].startswith('-n') and len(args[0]) > 2:
+            value, args = args[0][2:], args[1:]
+        elif args and re.fullmatch(r'-\d+', args[0]):
+            value, args = args[0][1:], args[1:]
+        if value is not None:
+            if not value.isdecimal():
+                yield f"head: неверное число строк: {value}"
+                return
+            count = int(value)
+
+        if not args:
+            if stdin is None:
+                yield "head: не указаны аргументы"
+                return
+            yield from islice(stdin, count)
+            return
+
+        for arg in args:
+            obj, error = self._open_file('head', arg)
+            if error:
+                yield error
+                continue
+            if len(args) > 1:
+                yield f"==> {arg} <=="
+            lines = iter_text_lines(obj.chunks())
+            try:
+                yield from islice(lines, count)
+            except UnicodeDecodeError:
+                yield f"head: {arg}: бинарный файл"
+            finally:
+                lines.close()
+
+    def cmd_wc(self, args, stdin=None):
+        flags, args = split_flags(args)
+        if set(flags) - set('lwc'):
+            yield f"wc: неверный ключ: -{flags}"
+            return
+        fields = [i for i, flag in enumerate('lwc') if flag in flags] or [0, 1, 2]
+
+        def format_counts(counts, name=None):
+            line = ' '.join(str(counts[i]) for i in fields)
+            return f"{line} {name}" if name else line
+
+        if not args:
+            if stdin is None:
+                yield "wc: не указаны аргументы"
+                return
+            yield format_counts(count_chunks((line + '\n').encode('utf-8') for line in stdin))
+            return
+
+        totals = (0, 0, 0)
+        for arg in args:
+            obj, error = self._open_file('wc', arg)
+            if error:
+                yield error
+                continue
+            counts = count_chunks(obj.chunks())
+            totals = tuple(a + b for a, b in zip(totals, counts))
+            yield format_counts(counts, arg)
+        if len(args) > 1:
+            yield format_counts(totals, 'итого')
+
+    def cmd_grep(self, args, stdin=None):
+        flags, args = split_flags(args)
+        if set(flags) - set('ivncr'):
+            yield f"grep: неверный ключ: -{flags}"
+            return
+        if not args:
+            yield "grep: не указан шаблон"
+            return
+        pattern, *files = args
+        pattern = unquote(pattern)
+        try:
+            regex = re.compile(pattern, re.IGNORECASE if 'i' in flags else 0)
+        except re.error as e:
+            yield f"grep: неверный шаблон: {e}"
+            return
+
+        if 'r' in flags:
+            yield from self._grep_recursive(regex, pattern, flags, files or ['.'])
+            return
+
+        if not files:
+            if stdin is None:
+                yield "grep: не указаны файлы"
+                return
+            yield from grep_lines(regex, stdin, flags)
+            return
+
+        for arg in files:
+            obj, error = self._open_file('grep', arg)
+            if error:
+                yield error
+                continue
+            try:
+                yield from grep_lines(regex, iter_text_lines(obj.chunks()), flags,
+                                      arg if len(files) > 1 else None)
+            except UnicodeDecodeError:
+                yield f"grep: {arg}: бинарный файл"
+
+    def _grep_recursive(self, regex, pattern, flags, targets):
+        index = self._trigram_index()
+        candidates = None
+        if index is not None and 'v' not in flags:
+            # Индекс триграмм отсекает файлы, в которых нет литеральных частей шаблона
+            candidates = index.candidates(required_literals(pattern))
+
+        def jobs():
+            # Ошибка цели передаётся строкой, чтобы она попала в вывод на своём месте
+            for target in targets:
+                try:
+                    base, display = self._subtree_target('grep', target)
+                except FileNotFoundError as e:
+                    yield str(e)
+                    continue
+                for path, node in self.vfs.walk(base):
+                    if not isinstance(node, FileNode):
+                        continue
+                    if index is not None:
+                        if index.is_binary(node):
+                            continue
+                        if not index.may_match(node, candidates):
+                            if 'c' in flags:
+                                yield None, display(path)
+                            continue
+                    yield node, display(path)
+
+        def results(item):
+            if isinstance(item, str):
+                return (item,)
+            return item.result() or ()
+
+        # Файлы читаются и проверяются параллельно, но в работе одновременно не больше
+        # GREP_WINDOW файлов: вывод идёт потоком в исходном порядке, бинарные файлы пропускаются
+        window = deque()
+        pool = ThreadPoolExecutor(max_workers=GREP_WORKERS)
+        try:
+            for job in jobs():
+                window.append(job if isinstance(job, str) else pool.submit(scan_file, regex, flags, *job))
+                if len(window) >= GREP_WINDOW:
+                    yield from results(window.popleft())
+            while window:
+                yield from results(window.popleft())
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+    def _trigram_index(self):
+        # Индекс строится в фоне для текущей VFS; пока он не готов, grep -r просматривает все файлы
+        if not self.text_index or not self.vfs_loaded:
+            return None
+        if self._trigrams is None or self._trigrams.vfs is not self.vfs:
+            self._trigrams = TrigramIndex(self.vfs).start()
+        return self._trigrams if self._trigrams.ready.is_set() else None
+
+    def _subtree_target(self, cmd, target):
+        # Возвращает абсолютный путь каталога или файла и префикс для вывода путей
+        try:
+            path, _ = self.vfs.resolve(tuple(self.current_dir), target)
+            base = path_str(path)
+        except PathError:
+            try:
+                parent, name, _ = self._resolve_path_and_parent(target)
+            except FileNotFoundError:
+                raise FileNotFoundError(f"{cmd}: {target}: нет такого файла или каталога")
+            base = path_str(parent + (name,))
+        prefix = target.rstrip('/')
+
+        def display(path):
+            if path == base:
+                return prefix or '/'
+            return prefix + (path if base == '/' else path[len(base):])
+        return base, display
+
+    def cmd_find(self, args, stdin=None):
+        target = '.'
+        if args and not args[0].startswith('-'):
+            target, *args = args
+        if args and (len(args) != 2 or args[0] != '-name'):
+            yield "find: использование: find [путь] [-name шаблон]"
+            return
+        try:
+            base, display = self._subtree_target('find', target)
+        except FileNotFoundError as e:
+            yield str(e)
+            return
+        if not args:
+            for path, _ in self.vfs.walk(base):
+                yield display(path)
+            return
+        for path in self.vfs.find(base, unquote(args[1])):
+            yield display(path)
+
+    def cmd_du(self, args, stdin=None):
+        summary = False
+        if args and args[0] == '-s':
+            summary = True
+            args = args[1:]
+        for target in args or ['.']:
+            try:
+                base, display = self._subtree_target('du', target)
+            except FileNotFoundError as e:
+                yield str(e)
+                continue
+            node = self.vfs.index[base]
+            if summary or not isinstance(node, DirNode):
+                yield f"{node_size(node)}\t{target}"
+                continue
+            # Каталоги выводятся после своих подкаталогов, размеры берутся готовыми
+            stack = [(base, node, False)]
+            while stack:
+                path, node, done = stack.pop()
+                if done:
+                    yield f"{node.total}\t{display(path)}"
+                    continue
+                stack.append((path, node, True))
+                for name, child in reversed(node.children.items()):
+                    if isinstance(child, DirNode):
+                        stack.append((join_path(path, name), child, False))
+
+    def cmd_cal(self, args):
+        try:
+            today = datetime.date.today()
+            if not args:
+                return calendar.month(today.year, today.month)
+            elif len(args) == 1:
+                year = int(args[0])
+                return calendar.calendar(year)
+            elif len(args) == 2:
+                month = int(args[0])
+                year = int(args[1])
+                return calendar.month(year, month)
+            else:
+                return "cal: слишком много аргументов"
+        except ValueError:
+            return f"cal: неверный аргумент: {args[0] if args else ''}"
+        except Exception:
+            return "cal: ошибка при выводе календаря"
+
+    def complete(self, line):
+        # Возвращает (новая строка, кандидаты, число непоказанных кандидатов)
+        segment = line.rpartition('|')[2].lstrip()
+        if segment.startswith('time '):
+            segment = segment[5:].lstrip()
+        token = segment.rpartition(' ')[2]
+        base = line[:len(line) - len(token)]
+
+        if token == segment:
+            names = [c for c in COMMANDS if c.startswith(token)]
+            head, prefix, ref = '', token, None
+        else:
+            if not self.vfs_loaded or token.startswith('-'):
+                return line, [], 0
+            head, _, prefix = token.rpartition('/')
+            if head or token.startswith('/'):
+                head += '/'
+            try:
+                _, ref = self.vfs.resolve(tuple(self.current_dir), head)
+            except PathError:
+                return line, [], 0
+            names = self.vfs.complete_names(ref, prefix)
+
+        if not names:
+            return line, [], 0
+        if len(names) == 1:
+            name = names[0]
+            suffix = '/' if ref is not None and isinstance(ref.children.get(name), DirNode) else ' '
+            return base + head + name + suffix, [], 0
+        # Имена отсортированы, общий префикс всех равен общему префиксу первого и последнего
+        common = os.path.commonprefix([names[0], names[-1]])
+        if len(common) > len(prefix):
+            return base + head + common, [], 0
+        return line, names[:COMPLETION_LIMIT], max(0, len(names) - COMPLETION_LIMIT)
+
+    def save_vfs(self, zip_path):
+        same_source = bool(self.vfs.source) and os.path.abspath(self.vfs.source) == os.path.abspath(zip_path)
+        if same_source and isinstance(self.vfs, OverlayVFS):
+            return f"savevfs: {zip_path}: исходный архив используется другими сессиями"
+        copied, packed = save_vfs_to_zip(self.vfs, zip_path)
+        if same_source:
+            # Ленивые файлы ссылались на смещения в перезаписанном архиве
+            self.vfs = load_vfs_from_zip(zip_path, lazy=self.lazy, cache_size=self.cache_size)
+        self.vfs.modified = False
+        return f"VFS сохранена в {zip_path}: скопировано без перепаковки {copied}, сжато заново {packed}"
+
+    def check_reload(self):
+        if not (self.watch and self.vfs_loaded and self.vfs.source) or isinstance(self.vfs, OverlayVFS):
+            return ""
+        now = perf_counter()
+        if now - self._reload_checked < self.watch:
+            return ""
+        self._reload_checked = now
+        stat = source_stat(self.vfs.source)
+        if stat is None or stat == self.vfs.source_stat:
+            return ""
+        if self.vfs.source_stat is None:
+            # VFS из снимка: снимок проверил архив при загрузке, отсчёт идёт от текущего состояния
+            self.vfs.source_stat = stat
+            return ""
+        try:
+            vfs, stats = reload_vfs(self.vfs, lazy=self.lazy, cache_size=self.cache_size)
+        except (zipfile.BadZipFile, OSError, ValueError) as e:
+            # Повторная попытка будет только после следующего изменения архива
+            self.vfs.source_stat = stat
+            return f"Не удалось перезагрузить VFS: {e}"
+        if vfs is None:
+            return ""
+        self.vfs = vfs
+        while self.current_dir and not isinstance(self.vfs.index.get(path_str(self.current_dir)), DirNode):
+            self.current_dir.pop()
+        self.update_prompt()
+        self._trigrams = None
+        self._trigram_index()
+        if stats is None:
+            return f"VFS перезагружена из {self.vfs.source}: архив изменился"
+        message = (f"VFS перезагружена из {self.vfs.source}: добавлено {stats['added']}, "
+                   f"изменено {stats['changed']}, удалено {stats['removed']}")
+        if stats['conflicts']:
+            message += f", пропущено из-за конфликтов с локальными изменениями {stats['conflicts']}"
+        return message
+
+    def script_profiler(self):
+        return cProfile.Profile() if self.profile else None
+
+    def dump_profile(self, profiler, script_path):
+        path = self.profile if isinstance(self.profile, str) else script_path + '.prof'
+        profiler.dump_stats(path)
+        return f"Профиль стартового скрипта записан в {path}"
+
+    def close(self):
+        if not (self.autosave and self.vfs_loaded and self.vfs.modified):
+            return ""
+        zip_path = self.vfs.source if self.autosave is True else self.autosave
+        if not zip_path:
+            return "Автосохранение пропущено: у VFS нет исходного архива"
+        return self.save_vfs(zip_path)
+
+    def update_prompt(self):
+        path_str = '/' + '/'.join(self.current_dir) if self.current_dir else '~'
+        self.prompt = f"{self.username}@{self.hostname}:{path_str}$ "
+
+    def execute_command(self, command_line: str) -> str:
+        return "\n".join(self.iter_command(command_line))
+
+    def iter_command(self, command_line):
+        notice = self.check_reload()
+        if notice:
+            yield notice
+        words = command_line.split(None, 1)
+        if words and words[0] == "time":
+            yield from self._time_command(words[1] if len(words) > 1 else "")
+            return
+        if self.metrics is None or not words:
+            yield from self._iter_pipeline(command_line)
+            return
+
+        start = perf_counter()
+        visited = self._visited()
+        try:
+            yield from self._iter_pipeline(command_line)
+        finally:
+            key = '|'.join(stage.split()[0] for stage in command_line.split('|') if stage.split())
+            self.metrics.record(key, perf_counter() - start, max(0, self._visited() - visited))
+
+    def _visited(self):
+        return self.vfs.visited if self.vfs_loaded else 0
+
+    def _time_command(self, command_line):
+        start = perf_counter()
+        visited = self._visited()
+        yield from self.iter_command(command_line)
+        elapsed = perf_counter() - start
+        yield f"real {elapsed * 1000:.3f} мс, узлов при разрешении путей: {max(0, self._visited() - visited)}"
+
+    def _iter_pipeline(self, command_line):
+        # Вывод выдаётся порциями; в конвейере a | b строки передаются лениво
+        stages = [stage.split() for stage in command_line.split('|')]
+        if len(stages) == 1 and not stages[0]:
+            return
+        if not all(stages):
+            yield "Ошибка: пустая команда в конвейере"
+            return
+
+        lines = None
+        for i, (cmd, *args) in enumerate(stages):
+            lines = self._run_stage(cmd, args, lines, i == len(stages) - 1)
+        yield from lines
+
+    def _run_stage(self, cmd, args, stdin, last):
+        if self.vfs_loaded:
+            if cmd == "rev":
+                return self.cmd_rev(args, stdin)
+            elif cmd == "head":
+                return self.cmd_head(args, stdin)
+            elif cmd == "wc":
+                return self.cmd_wc(args, stdin)
+            elif cmd == "grep":
+                return self.cmd_grep(args, stdin)
+            elif cmd == "find":
+                return self.cmd_find(args, stdin)
+            elif cmd == "du":
+                return self.cmd_du(args, stdin)
+
+        # Остальные команды выполняются целиком, их вывод делится на строки для следующей команды
+        output = self._run_command(cmd, args)
+        if not output:
+            return iter(())
+        return iter((output,)) if last else iter(output.splitlines())
+
+    def _run_command(self, cmd, args):
+        if cmd == "exit":
+            self.exit_requested = True
+            if self.on_exit:
+                self.on_exit()
+            return ""
+        if cmd in HOST_PATH_COMMANDS and not self.host_files:
+            return f"{cmd}: команда недоступна в этой сессии"
+        if cmd == "loadvfs":
+            if not args:
+                return "Укажите путь к VFS ZIP"
+            zip_path = args[0]
+            if not os.path.exists(zip_path):
+                return f"VFS не найден: {zip_path}"
+            self.vfs = load_vfs_from_zip(zip_path, lazy=self.lazy, cache_size=self.cache_size)
+            self.vfs_loaded = self.vfs is not None
+            self.current_dir = []
+            self.update_prompt()
+            self._trigram_index()
+            dedup = format_dedup(self.vfs)
+            return f"VFS загружена из {zip_path}" + (f"\n{dedup}" if dedup else "")
+        if cmd == "loadsnap":
+            if not args:
+                return "Укажите путь к снимку VFS"
+            snap_path = args[0]
+            if not os.path.exists(snap_path):
+                return f"Снимок не найден: {snap_path}"
+            try:
+                self.vfs = load_snapshot(snap_path, cache_size=self.cache_size)
+            except ValueError as e:
+                return f"loadsnap: {e}"
+            self.vfs_loaded = True
+            self.current_dir = []
+            self.update_prompt()
+            self._trigram_index()
+            return f"VFS загружена из снимка {snap_path}"
+        if cmd == "stats":
+            if self.metrics is None:
+                return "stats: сбор статистики выключен, запустите эмулятор с --profile"
+            return self.metrics.format()
+
+        if not self.vfs_loaded:
+            return "Ошибка: VFS не загружена. Введите loadvfs <путь> или exit"
+
+        if cmd == "ls":
+            return self.cmd_ls(args)
+        elif cmd == "cd":
+            return self.cmd_cd(args)
+        elif cmd == "cal":
+            return self.cmd_cal(args)
+        elif cmd == "mv":
+            return self.cmd_mv(args)
+        elif cmd == "chown":
+            return self.cmd_chown(args)
+        elif cmd == "savesnap":
+            if not args:
+                return "Укажите путь к файлу снимка"
+            count = save_snapshot(self.vfs, args[0])
+            return f"Снимок VFS сохранён в {args[0]} ({count} узлов)"
+        elif cmd == "savevfs":
+            if not args:
+                return "Укажите путь к ZIP для сохранения VFS"
+            return self.save_vfs(args[0])
+        else:
+            return f"Команда не найдена: {cmd}"
+
+    def stream_line(self, line):
+        try:
+            yield from self.iter_command(line)
+        except Exception as e:
+            yield f"Ошибка при выполнении команды: {e}"
+
+    def run_line(self, line):
+        return "\n".join(self.stream_line(line))
+
+
+def run_headless(shell, script_path, out):
+    if not shell.vfs_loaded:
+        print(VFS_NOT_LOADED_WARNING, file=out)
+        return 1
+    if not script_path:
+        return 0
+    if not os.path.exists(script_path):
+        print(f"Ошибка: стартовый скрипт не найден: {script_path}", file=out)
+        return 1
+
+    profiler = shell.script_profiler()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        for line in read_script(script_path):
+            print(shell.prompt + line, file=out)
+            for chunk in shell.stream_line(line):
+                print(chunk, file=out)
+            out.flush()
+            if shell.exit_requested:
+                break
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            print(shell.dump_profile(profiler, script_path), file=out)
+    return 0
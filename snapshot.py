@@ -0,0 +1,259 @@
+import os
+import sys
+import mmap
+import struct
+import zipfile
+
+from vfs import CHUNK_SIZE, VFS, ContentCache, DirNode, FileNode, ZipSource, join_path, source_stat
+
+# Формат снимка (little-endian):
+#   заголовок | записи узлов фиксированного размера | строки | данные файлов
+# Узлы записаны в порядке обхода в ширину, поэтому родитель всегда раньше потомков.
+MAGIC = b'VFSSNAP1'
+VERSION = 1
+HEADER = struct.Struct('<8sIQQQQIIIIQQ')
+NODE = struct.Struct('<IIIIIIBxHHIQQQ')
+NO_PARENT = 0xFFFFFFFF
+
+KIND_DIR = 0
+KIND_DATA = 1
+KIND_ZIP = 2
+
+(R_PARENT, R_NAME_OFF, R_NAME_LEN, R_ZNAME_OFF, R_ZNAME_LEN, R_OWNER, R_KIND,
+ R_COMPRESS_TYPE, R_FLAG_BITS, R_CRC, R_OFFSET, R_COMPRESS_SIZE, R_FILE_SIZE) = range(13)
+
+
+class SnapshotContent:
+    # Содержимое файла из снимка: либо данные внутри снимка, либо член исходного ZIP
+    __slots__ = ('snap', 'record', 'size')
+
+    def __init__(self, snap, record, size):
+        self.snap = snap
+        self.record = record
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def read(self):
+        return self.snap.read(self.record)
+
+    def chunks(self, size=CHUNK_SIZE):
+        return self.snap.iter_chunks(self.record, size)
+
+    def zipinfo(self):
+        return self.snap.zipinfo(self.record)
+
+    def zip_origin(self):
+        info = self.snap.zipinfo(self.record)
+        if info is None:
+            return None
+        return self.snap.source.path, info
+
+
+class Snapshot:
+    def __init__(self, path, cache_size=0):
+        self.path = path
+        self.cache_size = cache_size
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mm) < HEADER.size:
+            raise ValueError(f"{path}: не является снимком VFS")
+        (magic, version, self.node_count, self.nodes_offset, self.strings_offset, self.data_offset,
+         source_off, source_len, owners_off, owners_len,
+         self.source_size, self.source_mtime) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: не является снимком VFS")
+        if (self.strings_offset - self.nodes_offset != self.node_count * NODE.size
+                or not HEADER.size <= self.nodes_offset <= self.strings_offset <= self.data_offset <= len(self.mm)):
+            raise ValueError(f"{path}: снимок повреждён")
+
+        self.strings = self.mm[self.strings_offset:self.data_offset]
+        try:
+            self.owners = [sys.intern(o) for o in self.string(owners_off, owners_len).split('\0')]
+            source_path = self.source_path = self.string(source_off, source_len) or None
+        except UnicodeDecodeError:
+            raise ValueError(f"{path}: снимок повреждён")
+        self.source = None
+        if source_path:
+            try:
+                st = os.stat(source_path)
+            except OSError:
+                raise ValueError(f"архив снимка не найден: {source_path}")
+            if st.st_size != self.source_size or st.st_mtime_ns != self.source_mtime:
+                raise ValueError(f"снимок устарел: архив {source_path} изменился")
+            self.source = ZipSource(source_path, ContentCache(cache_size) if cache_size > 0 else None)
+
+    def __getstate__(self):
+        return {'path': self.path, 'cache_size': self.cache_size}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['cache_size'])
+
+    def string(self, offset, length):
+        return self.strings[offset:offset + length].decode('utf-8')
+
+    def record(self, i):
+        return NODE.unpack_from(self.mm, self.nodes_offset + i * NODE.size)
+
+    def zipinfo(self, i):
+        rec = self.record(i)
+        if rec[R_KIND] != KIND_ZIP:
+            return None
+        info = zipfile.ZipInfo(self.string(rec[R_ZNAME_OFF], rec[R_ZNAME_LEN]))
+        info.header_offset = rec[R_OFFSET]
+        info.compress_size = rec[R_COMPRESS_SIZE]
+        info.file_size = rec[R_FILE_SIZE]
+        info.CRC = rec[R_CRC]
+        info.compress_type = rec[R_COMPRESS_TYPE]
+        info.flag_bits = rec[R_FLAG_BITS]
+        return info
+
+    def read(self, i):
+        rec = self.record(i)
+        if rec[R_KIND] == KIND_ZIP:
+            return self.source.read(self.zipinfo(i))
+        start = self.data_offset + rec[R_OFFSET]
+        return self.mm[start:start + rec[R_FILE_SIZE]]
+
+    def iter_chunks(self, i, size=CHUNK_SIZE):
+        rec = self.record(i)
+        if rec[R_KIND] == KIND_ZIP:
+            yield from self.source.iter_chunks(self.zipinfo(i), size)
+            return
+        start = self.data_offset + rec[R_OFFSET]
+        end = start + rec[R_FILE_SIZE]
+        for pos in range(start, end, size):
+            yield self.mm[pos:min(pos + size, end)]
+
+
+def _zip_origin(content, source):
+    # Возвращает ZipInfo, если содержимое можно сослать на исходный архив
+    if source is None or isinstance(content, bytes):
+        return None
+    origin = content.zip_origin()
+    if origin is None or os.path.abspath(origin[0]) != source:
+        return None
+    return origin[1]
+
+
+def save_snapshot(vfs, path):
+    # Исходный архив записывается всегда, когда он есть: по нему загрузка проверяет,
+    # что снимок не устарел, и восстанавливает vfs.source (savevfs, --autosave, --watch)
+    source = os.path.abspath(vfs.source) if vfs.source and os.path.exists(vfs.source) else None
+    strings = bytearray()
+    owners = {}
+    records = []
+    inline = []
+    data_size = 0
+
+    def add_string(text):
+        offset = len(strings)
+        strings.extend(text.encode('utf-8'))
+        return offset, len(strings) - offset
+
+    nodes = [(NO_PARENT, '', vfs.root)]
+    i = 0
+    while i < len(nodes):
+        parent, name, node = nodes[i]
+        name_off, name_len = add_string(name)
+        owner = owners.setdefault(node.owner, len(owners))
+        if isinstance(node, DirNode):
+            records.append((parent, name_off, name_len, 0, 0, owner, KIND_DIR, 0, 0, 0, 0, 0, 0))
+            for child_name, child in node.children.items():
+                nodes.append((i, child_name, child))
+        else:
+            info = _zip_origin(node.content, source)
+            if info is not None:
+                zname_off, zname_len = add_string(info.orig_filename)
+                records.append((parent, name_off, name_len, zname_off, zname_len, owner, KIND_ZIP,
+                                info.compress_type, info.flag_bits, info.CRC, info.header_offset,
+                                info.compress_size, info.file_size))
+            else:
+                size = node.size
+                records.append((parent, name_off, name_len, 0, 0, owner, KIND_DATA,
+                                0, 0, 0, data_size, size, size))
+                inline.append(node)
+                data_size += size
+        i += 1
+
+    owners_off, owners_len = add_string('\0'.join(owners))
+    if source:
+        source_off, source_len = add_string(source)
+        st = os.stat(source)
+        source_size, source_mtime = st.st_size, st.st_mtime_ns
+    else:
+        source_off, source_len, source_size, source_mtime = 0, 0, 0, 0
+
+    nodes_offset = HEADER.size
+    strings_offset = nodes_offset + NODE.size * len(records)
+    data_offset = strings_offset + len(strings)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(records), nodes_offset, strings_offset, data_offset,
+                            source_off, source_len, owners_off, owners_len, source_size, source_mtime))
+        f.write(b''.join(NODE.pack(*rec) for rec in records))
+        f.write(strings)
+        for node in inline:
+            f.write(node.read())
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+def load_snapshot(path, cache_size=0):
+    snap = Snapshot(path, cache_size)
+    try:
+        return _build_tree(snap)
+    except (struct.error, IndexError, AttributeError, UnicodeDecodeError):
+        # Ссылки на родителей, владельцев или строки за пределами снимка
+        raise ValueError(f"{path}: снимок повреждён")
+
+
+def _build_tree(snap):
+    nodes = []
+    parents = []
+    paths = []
+    index = {}
+    strings = snap.strings
+    owners = snap.owners
+    view = snap.mm[snap.nodes_offset:snap.strings_offset]
+    data_size = len(snap.mm) - snap.data_offset
+    for i, rec in enumerate(NODE.iter_unpack(view)):
+        owner = owners[rec[R_OWNER]]
+        is_dir = rec[R_KIND] == KIND_DIR
+        if is_dir:
+            node = DirNode(owner)
+        else:
+            if rec[R_KIND] == KIND_DATA and rec[R_OFFSET] + rec[R_FILE_SIZE] > data_size:
+                raise IndexError(i)
+            node = FileNode(SnapshotContent(snap, i, rec[R_FILE_SIZE]), owner)
+        parent = rec[R_PARENT]
+        if parent == NO_PARENT:
+            node_path = '/'
+        else:
+            name = sys.intern(strings[rec[R_NAME_OFF]:rec[R_NAME_OFF] + rec[R_NAME_LEN]].decode('utf-8'))
+            # Имена в снимке уникальны, счётчики каталога обновляем без DirNode.add
+            parent_node = nodes[parent]
+            parent_node.children[name] = node
+            if is_dir:
+                parent_node.ndirs += 1
+            else:
+                parent_node.nfiles += 1
+                parent_node.size += rec[R_FILE_SIZE]
+            node_path = sys.intern(join_path(paths[parent], name))
+        nodes.append(node)
+        parents.append(parent)
+        paths.append(node_path)
+        index[node_path] = node
+    if not nodes:
+        raise ValueError(f"{snap.path}: снимок пуст")
+    # Потомки записаны после родителей: обратный проход суммирует размеры поддеревьев
+    for i in range(len(nodes) - 1, -1, -1):
+        node = nodes[i]
+        if isinstance(node, DirNode):
+            node.total += node.size
+            if i:
+                nodes[parents[i]].total += node.total
+    vfs = VFS(nodes[0], source=snap.source_path, index=index, zip_source=snap.source)
+    vfs.source_stat = source_stat(snap.source_path) if snap.source_path else None
+    return vfs
@@ -0,0 +1,430 @@
+from kivy.config import Config
+Config.set('input', 'mouse', 'mouse,multitouch_on_demand')
+
+import os
+import time
+from collections import deque
+from itertools import islice
+from kivy.app import App
+from kivy.clock import Clock
+from kivy.uix.textinput import TextInput, FL_IS_LINEBREAK
+from kivy.core.window import Window
+
+from shell import Shell, VFS_NOT_LOADED_WARNING, format_script_timings, read_script
+from history import DEFAULT_HISTORY_FILE, HISTORY_MAX_BYTES, TAG_SCRIPT, CommandHistory
+
+DEFAULT_FONT_SIZE = 16
+MIN_FONT_SIZE = 8
+MAX_FONT_SIZE = 40
+DEFAULT_SCROLLBACK = 10000
+DEFAULT_FLUSH_LINES = 500
+DEFAULT_FLUSH_INTERVAL = 0.05
+# Клавиши, которые завершают поиск Ctrl-R и оставляют найденную команду для правки
+SEARCH_EXIT_KEYS = ('up', 'down', 'left', 'right', 'home', 'end', 'tab', 'pageup', 'pagedown', 'delete')
+
+
+class Scrollback:
+    # Кольцевой буфер строк вывода: старые строки вытесняются при переполнении
+    def __init__(self, max_lines=DEFAULT_SCROLLBACK):
+        self.lines = deque(maxlen=max_lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def append_text(self, text):
+        self.lines.extend(text.split("\n"))
+
+    def window(self, offset, count):
+        # count строк, заканчивающихся за offset строк до конца буфера
+        tail = list(islice(reversed(self.lines), offset, offset + count))
+        tail.reverse()
+        return tail
+
+
+class Terminal(TextInput):
+    def __init__(self, vfs=None, start_script=None, debug=False, lazy=False, cache_size=0,
+                 scrollback=DEFAULT_SCROLLBACK, flush_lines=DEFAULT_FLUSH_LINES,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, autosave=None, text_index=False, profile=None,
+                 watch=None, history=None, **kwargs):
+        super().__init__(**kwargs)
+        self.debug = debug
+        self.flush_lines = flush_lines
+        self.flush_interval = flush_interval
+        self._script = None
+        self.shell = Shell(vfs=vfs, lazy=lazy, cache_size=cache_size, autosave=autosave,
+                           text_index=text_index, profile=profile, watch=watch)
+        self.shell.on_exit = lambda: App.get_running_app().stop()
+
+        # В виджете лежит только видимое окно буфера и строка ввода
+        self.scrollback = Scrollback(scrollback)
+        self._view_offset = 0
+        self._prompt_len = len(self.prompt)
+        self.text = self.prompt
+        self.multiline = True
+
+        # Набранные команды и строки стартового скрипта пишутся в файл истории с разными метками
+        self.history = history if history is not None else CommandHistory()
+        self.history_index = None
+        self.current_input = ""
+        self._search = None
+
+        self.background_color = (0, 0, 0, 1)
+        self.foreground_color = (0, 1, 0, 1)
+        self.font_size = DEFAULT_FONT_SIZE
+        self.font_name = 'DejaVuSansMono'
+
+        self._trigger_render = Clock.create_trigger(lambda dt: self._render())
+        self.bind(size=self._trigger_render, font_size=self._trigger_render)
+
+        if not self.shell.vfs_loaded:
+            self._write(self.prompt)
+            self._write(VFS_NOT_LOADED_WARNING)
+            self._show_prompt()
+
+        if start_script and self.shell.vfs_loaded:
+            self.run_start_script(start_script)
+        if watch:
+            Clock.schedule_interval(self._poll_reload, watch)
+
+    @property
+    def prompt(self):
+        return self.shell.prompt
+
+    def _input_start_row(self):
+        # Приглашение всегда начинает последнюю логическую строку,
+        # поэтому достаточно пройти только её экранные строки
+        flags = self._lines_flags
+        row = len(self._lines) - 1
+        while row > 0 and not flags[row] & FL_IS_LINEBREAK:
+            row -= 1
+        return row
+
+    def _input_col(self):
+        col, row = self.cursor
+        start = self._input_start_row()
+        if row < start:
+            return -1
+        return sum(len(line) for line in self._lines[start:row]) + col
+
+    def _get_input_line(self):
+        return ''.join(self._lines[self._input_start_row():])[self._prompt_len:]
+
+    def _set_input_col(self, offset):
+        lines = self._lines
+        row = self._input_start_row()
+        while row < len(lines) - 1 and offset > len(lines[row]):
+            offset -= len(lines[row])
+            row += 1
+        self.cursor = (min(offset, len(lines[row])), row)
+
+    def _cursor_to_end(self):
+        self.cursor = (len(self._lines[-1]), len(self._lines) - 1)
+
+    def _visible_rows(self):
+        row_height = self.line_height + self.line_spacing
+        if row_height <= 0:
+            return 1
+        return max(1, int(self.height // row_height) - 1)
+
+    def _write(self, text):
+        self.scrollback.append_text(text)
+
+    def _render(self, input_text=None):
+        if self._search is not None:
+            line = self._search_line()
+        else:
+            if input_text is None:
+                input_text = self._get_input_line()
+            line = self.prompt[:self._prompt_len] + input_text
+        max_offset = max(0, len(self.scrollback) - self._visible_rows())
+        self._view_offset = min(self._view_offset, max_offset)
+        lines = self.scrollback.window(self._view_offset, self._visible_rows())
+        lines.append(line)
+        self.text = "\n".join(lines)
+        self._cursor_to_end()
+
+    def _scroll(self, rows):
+        self._view_offset = max(0, self._view_offset + rows)
+        self._render()
+
+    def _show_prompt(self):
+        self._prompt_len = len(self.prompt)
+        self._view_offset = 0
+        self._render("")
+
+    def on_touch_down(self, touch):
+        if self.collide_point(*touch.pos) and touch.is_mouse_scrolling:
+            if touch.button == 'scrolldown':
+                self._scroll(3)
+            elif touch.button == 'scrollup':
+                self._scroll(-3)
+            return True
+        return super().on_touch_down(touch)
+
+    def insert_text(self, substring, from_undo=False):
+        if self._script is not None:
+            return
+        if self._search is not None:
+            self._search['query'] += substring
+            self._reverse_search(restart=True)
+            return
+        if self._view_offset:
+            self._view_offset = 0
+            self._render()
+        if self._input_col() < self._prompt_len:
+            self._set_input_col(self._prompt_len)
+        return super().insert_text(substring, from_undo=from_undo)
+
+    def do_backspace(self, from_undo=False, mode='bkspc'):
+        if self._search is not None:
+            self._search['query'] = self._search['query'][:-1]
+            self._reverse_search(restart=True)
+            return
+        if self._input_col() <= self._prompt_len:
+            return
+        super().do_backspace(from_undo, mode)
+
+    def keyboard_on_key_down(self, window, keycode, text, modifiers):
+        if self._script is not None:
+            # Пока выполняется стартовый скрипт, ввод игнорируется
+            return True
+        if 'ctrl' in modifiers and keycode[1] == 'r':
+            if self._search is None:
+                self._search = {'query': '', 'index': None, 'original': self._get_input_line()}
+                self._render()
+            else:
+                self._reverse_search()
+            return True
+        if self._search is not None:
+            if keycode[1] == 'backspace':
+                self.do_backspace()
+                return True
+            if 'ctrl' in modifiers and keycode[1] == 'g':
+                # Отмена поиска возвращает строку, набранную до Ctrl-R (Esc в Kivy закрывает окно)
+                self._finish_search(self._search['original'])
+                return True
+            if keycode[1] in SEARCH_EXIT_KEYS:
+                # Прочие управляющие клавиши оставляют найденную команду для правки
+                self._finish_search(self._search_match())
+                return True
+            if keycode[1] == 'enter':
+                self._finish_search(self._search_match())
+        if 'ctrl' in modifiers:
+            if text == '+' or keycode[1] in ('plus', 'kp_plus', 'equal', '='):
+                self.font_size = min(self.font_size + 1, MAX_FONT_SIZE)
+                return True
+            if text == '-' or keycode[1] in ('minus', 'kp_minus', '_'):
+                self.font_size = max(self.font_size - 1, MIN_FONT_SIZE)
+                return True
+            if text == '0' or keycode[1] in ('0', 'numpad0'):
+                self.font_size = DEFAULT_FONT_SIZE
+                return True
+
+        if keycode[1] == "enter":
+            input_line = self._get_input_line()
+            self._write(self.prompt[:self._prompt_len] + input_line)
+            command_line = input_line.strip()
+            if command_line:
+                self.history.append(command_line)
+            self.history_index = None
+            self.current_input = ""
+
+            # Вывод команды идёт потоком прямо в ограниченный буфер прокрутки
+            for chunk in self.shell.iter_command(command_line):
+                self._write(chunk)
+            self._show_prompt()
+            return True
+
+        if keycode[1] == "tab":
+            self._complete()
+            return True
+
+        if keycode[1] in ("pageup", "pagedown"):
+            rows = self._visible_rows()
+            self._scroll(rows if keycode[1] == "pageup" else -rows)
+            return True
+
+        if keycode[1] in ("up", "down"):
+            if self.history:
+                if self.history_index is None:
+                    self.current_input = self._get_input_line()
+                    self.history_index = len(self.history)
+                if keycode[1] == "up":
+                    self.history_index = max(0, self.history_index - 1)
+                else:
+                    self.history_index = min(len(self.history) - 1, self.history_index + 1)
+                if 0 <= self.history_index < len(self.history):
+                    line = self.history[self.history_index]
+                else:
+                    line = self.current_input
+                self._replace_current_line(line)
+            return True
+
+        if keycode[1] == "left":
+            if self._input_col() <= self._prompt_len:
+                return True
+        if keycode[1] == "home":
+            self._set_input_col(self._prompt_len)
+            return True
+
+        return super().keyboard_on_key_down(window, keycode, text, modifiers)
+
+    def _search_match(self):
+        index = self._search['index']
+        return self.history[index] if index is not None else self._search['original']
+
+    def _search_line(self):
+        search = self._search
+        failed = search['query'] and search['index'] is None
+        match = self.history[search['index']] if search['index'] is not None else ''
+        return f"({'failed ' if failed else ''}reverse-i-search)`{search['query']}': {match}"
+
+    def _reverse_search(self, restart=False):
+        # Ctrl-R ищет следующую более старую команду с подстрокой, повторы найденной пропускаются
+        search = self._search
+        before = None if restart or search['index'] is None else search['index']
+        current = None if restart or search['index'] is None else self.history[search['index']]
+        index = self.history.search(search['query'], before) if search['query'] else None
+        while index is not None and self.history[index] == current:
+            index = self.history.search(search['query'], index)
+        if index is not None or restart:
+            search['index'] = index
+        self._render()
+
+    def _finish_search(self, line):
+        self._search = None
+        self.history_index = None
+        self._replace_current_line(line)
+
+    def _poll_reload(self, dt):
+        # Во время стартового скрипта архив проверяется перед каждой его командой
+        if self._script is not None or self._search is not None:
+            return
+        notice = self.shell.check_reload()
+        if notice:
+            input_line = self._get_input_line()
+            self._write(notice)
+            # После перезагрузки текущий каталог мог смениться вместе с приглашением
+            self._prompt_len = len(self.prompt)
+            self._replace_current_line(input_line)
+
+    def _complete(self):
+        line = self._get_input_line()
+        new_line, candidates, more = self.shell.complete(line)
+        if candidates:
+            # Список кандидатов ограничен, чтобы большой каталог не задерживал ввод
+            self._write(self.prompt[:self._prompt_len] + line)
+            self._write("  ".join(candidates) + (f"\n... и ещё {more}" if more else ""))
+        self._replace_current_line(new_line)
+
+    def _replace_current_line(self, text):
+        self._view_offset = 0
+        self._render(text)
+
+    def run_start_script(self, script_path):
+        self._write(self.prompt[:self._prompt_len] + self._get_input_line())
+        if not os.path.exists(script_path):
+            self._write(f"Ошибка: стартовый скрипт не найден: {script_path}")
+            self._show_prompt()
+            return
+
+        # Скрипт выполняется порциями по кадрам Clock, вывод копится в буфере
+        # и сбрасывается в виджет раз в flush_lines строк или flush_interval секунд
+        self._script = read_script(script_path)
+        self._script_buffer = []
+        self._script_buffered = 0
+        self._script_timings = []
+        self._script_start = time.perf_counter()
+        self._script_path = script_path
+        # Профилируются только шаги скрипта, отрисовка Kivy между ними не попадает в профиль
+        self._profiler = self.shell.script_profiler()
+        Clock.schedule_once(self._run_script_step)
+
+    def _buffer_script_output(self, text):
+        self._script_buffer.append(text)
+        self._script_buffered += text.count("\n") + 1
+
+    def _flush_script_output(self, render=True):
+        if self._script_buffer:
+            self._write("\n".join(self._script_buffer))
+            self._script_buffer = []
+            self._script_buffered = 0
+        if render:
+            self._render()
+
+    def _run_script_step(self, dt):
+        if self._profiler is not None:
+            self._profiler.enable()
+        try:
+            self._run_script_lines()
+        finally:
+            if self._profiler is not None:
+                self._profiler.disable()
+        if self._script is None and self._profiler is not None:
+            self._write(self.shell.dump_profile(self._profiler, self._script_path))
+            self._render()
+
+    def _run_script_lines(self):
+        deadline = time.perf_counter() + self.flush_interval
+        for line in self._script:
+            self._buffer_script_output(self.prompt + line)
+            self.history.append(line, TAG_SCRIPT)
+
+            start = time.perf_counter()
+            for chunk in self.shell.stream_line(line):
+                self._buffer_script_output(chunk)
+                if self._script_buffered >= self.flush_lines:
+                    # Длинный вывод одной команды не копится в памяти целиком
+                    self._flush_script_output(render=False)
+            self._script_timings.append((line.split()[0], time.perf_counter() - start))
+
+            if self.shell.exit_requested:
+                break
+            if self._script_buffered >= self.flush_lines or time.perf_counter() >= deadline:
+                self._flush_script_output()
+                Clock.schedule_once(self._run_script_step)
+                return
+
+        self._script.close()
+        self._script = None
+        self._buffer_script_output(format_script_timings(time.perf_counter() - self._script_start,
+                                                         self._script_timings))
+        self._flush_script_output()
+        self._show_prompt()
+
+
+class TerminalApp(App):
+    def __init__(self, vfs=None, start_script=None, lazy=False, cache_size=0,
+                 scrollback=DEFAULT_SCROLLBACK, flush_lines=DEFAULT_FLUSH_LINES,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, autosave=None, text_index=False, profile=None,
+                 watch=None, history_file=DEFAULT_HISTORY_FILE, history_size=HISTORY_MAX_BYTES, **kwargs):
+        self.vfs = vfs
+        self.start_script = start_script
+        self.lazy = lazy
+        self.cache_size = cache_size
+        self.scrollback = scrollback
+        self.flush_lines = flush_lines
+        self.flush_interval = flush_interval
+        self.autosave = autosave
+        self.text_index = text_index
+        self.profile = profile
+        self.watch = watch
+        self.history_file = history_file
+        self.history_size = history_size
+        super().__init__(**kwargs)
+
+    def build(self):
+        return Terminal(vfs=self.vfs, start_script=self.start_script,
+                        lazy=self.lazy, cache_size=self.cache_size, scrollback=self.scrollback,
+                        flush_lines=self.flush_lines, flush_interval=self.flush_interval,
+                        autosave=self.autosave, text_index=self.text_index,
+                        profile=self.profile, watch=self.watch,
+                        history=CommandHistory(self.history_file, self.history_size).start())
+
+    def on_start(self):
+        shell = self.root.shell
+        Window.set_title(f"Эмулятор - [{shell.username}@{shell.hostname}]")
+
+    def on_stop(self):
+        self.root.history.close()
+        self.root.shell.close()
@@ -0,0 +1,40 @@
+import pickle
+import zipfile
+
+import batch
+from vfs import load_vfs_from_zip
+
+
+def make_zip(path):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('a/x.txt', b'same')
+        z.writestr('a/y.txt', b'same')
+        z.writestr('b.txt', b'other')
+
+
+def test_eager_vfs_pickles_for_spawned_workers(tmp_path):
+    # При spawn и forkserver дерево передаётся рабочим процессам через pickle
+    zip_path = tmp_path / 'vfs.zip'
+    make_zip(zip_path)
+    vfs = load_vfs_from_zip(str(zip_path))
+    copy = pickle.loads(pickle.dumps(vfs))
+    assert copy.dedup.files == vfs.dedup.files == 3
+    assert copy.dedup.duplicates == 1
+    assert copy.index['/a/y.txt'].read() == b'same'
+
+
+def test_batch_worker_runs_on_unpickled_vfs(tmp_path):
+    zip_path = tmp_path / 'vfs.zip'
+    make_zip(zip_path)
+    script = tmp_path / 'script.txt'
+    script.write_text('mv /b.txt /a/c.txt\nls /a\n', encoding='utf-8')
+    vfs = pickle.loads(pickle.dumps(load_vfs_from_zip(str(zip_path))))
+    batch._init_worker(vfs, {})
+    try:
+        _, rc, output, _ = batch._run_one(str(script))
+        assert rc == 0
+        assert 'c.txt' in output
+        # Изменения скрипта не попадают в общее дерево
+        assert '/b.txt' in vfs.index
+    finally:
+        batch._base_vfs = None
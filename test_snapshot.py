@@ -0,0 +1,19 @@
+import zipfile
+
+import pytest
+
+from snapshot import load_snapshot, save_snapshot
+from vfs import load_vfs_from_zip
+
+
+def test_corrupt_snapshot_raises_value_error(tmp_path):
+    # main.load_vfs перестраивает VFS из ZIP только после ValueError
+    zip_path = tmp_path / 'vfs.zip'
+    with zipfile.ZipFile(zip_path, 'w') as z:
+        z.writestr('a/x.txt', b'x')
+    snap_path = tmp_path / 'vfs.snap'
+    save_snapshot(load_vfs_from_zip(str(zip_path)), str(snap_path))
+    data = snap_path.read_bytes()
+    snap_path.write_bytes(data[:-3])
+    with pytest.raises(ValueError):
+        load_snapshot(str(snap_path))
@@ -0,0 +1,122 @@
+import threading
+
+from vfs import FileNode
+
+# Файлы больше этого размера не индексируются и всегда остаются кандидатами
+MAX_INDEXED_SIZE = 16 * 1024 * 1024
+
+
+def required_literals(pattern):
+    # Литеральные фрагменты, которые обязаны входить в любое совпадение регулярного выражения.
+    # Разбор консервативный: всё, в чём нет уверенности, просто не даёт фрагментов
+    if '|' in pattern:
+        return []
+    literals = []
+    run = ''
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        char = None
+        if c == '\\':
+            escaped = pattern[i + 1:i + 2]
+            if escaped and escaped in 'xuUN0123456789':
+                # Коды символов и обратные ссылки не разбираем
+                return []
+            if escaped and not escaped.isalnum():
+                char = escaped
+            i += 2
+        elif c == '[':
+            i += 1
+            if pattern[i:i + 1] == ']':
+                i += 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+            i += 1
+        elif c == '{':
+            end = pattern.find('}', i)
+            i = end + 1 if end != -1 else len(pattern)
+        elif c == '(':
+            depth += 1
+            i += 1
+        elif c == ')':
+            depth -= 1
+            i += 1
+        elif c in '.^$*+?}':
+            i += 1
+        else:
+            char = c
+            i += 1
+
+        if char is None or depth:
+            literals.append(run)
+            run = ''
+            continue
+        quantifier = pattern[i:i + 1]
+        if quantifier in ('*', '?', '{'):
+            # Символ может отсутствовать
+            literals.append(run)
+            run = ''
+        elif quantifier == '+':
+            literals.append(run + char)
+            run = ''
+        else:
+            run += char
+    literals.append(run)
+    return [literal for literal in literals if literal]
+
+
+class TrigramIndex:
+    # Инвертированный индекс триграмм по текстовым файлам VFS, строится в фоновом потоке.
+    # Ключ — сам узел файла, поэтому mv и chown индекс не портят
+    def __init__(self, vfs):
+        self.vfs = vfs
+        self.ids = {}
+        self.postings = {}
+        self.binary = set()
+        self.unindexed = set()
+        self.ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._build, name='trigram-index', daemon=True).start()
+        return self
+
+    def _build(self):
+        try:
+            for node in list(self.vfs.index.values()):
+                if not isinstance(node, FileNode):
+                    continue
+                file_id = self.ids.setdefault(node, len(self.ids))
+                if node.size > MAX_INDEXED_SIZE:
+                    self.unindexed.add(file_id)
+                    continue
+                try:
+                    text = node.read().decode('utf-8').lower()
+                except UnicodeDecodeError:
+                    self.binary.add(file_id)
+                    continue
+                for gram in {text[i:i + 3] for i in range(len(text) - 2)}:
+                    self.postings.setdefault(gram, []).append(file_id)
+        finally:
+            self.ready.set()
+
+    def candidates(self, literals):
+        # Номера файлов, содержащих все триграммы фрагментов; None — сузить нельзя
+        grams = {literal.lower()[i:i + 3] for literal in literals for i in range(len(literal) - 2)}
+        if not grams:
+            return None
+        result = None
+        for gram in sorted(grams, key=lambda g: len(self.postings.get(g, ()))):
+            ids = self.postings.get(gram, ())
+            result = set(ids) if result is None else result.intersection(ids)
+            if not result:
+                break
+        return result | self.unindexed
+
+    def is_binary(self, node):
+        file_id = self.ids.get(node)
+        return file_id is not None and file_id in self.binary
+
+    def may_match(self, node, candidates):
+        file_id = self.ids.get(node)
+        return file_id is None or candidates is None or file_id in candidates
@@ -0,0 +1,750 @@
+import os
+import re
+import sys
+import struct
+import hashlib
+import fnmatch
+import threading
+import zipfile
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Размер порции при потоковом чтении содержимого файла
+CHUNK_SIZE = 64 * 1024
+
+# Пакет файлов для одной задачи параллельной загрузки
+LOAD_BATCH_FILES = 256
+LOAD_BATCH_BYTES = 8 * 1024 * 1024
+
+# Владелец узла хранится в extra-поле записи ZIP с этим идентификатором
+OWNER_EXTRA_ID = 0x6F77
+EXTRA_HEADER = struct.Struct('<HH')
+
+
+def owner_extra(owner):
+    data = owner.encode('utf-8')
+    return EXTRA_HEADER.pack(OWNER_EXTRA_ID, len(data)) + data
+
+
+def zip_owner(extra, default='user'):
+    pos = 0
+    while pos + EXTRA_HEADER.size <= len(extra):
+        field_id, size = EXTRA_HEADER.unpack_from(extra, pos)
+        pos += EXTRA_HEADER.size
+        if field_id == OWNER_EXTRA_ID:
+            return extra[pos:pos + size].decode('utf-8', 'replace')
+        pos += size
+    return default
+
+
+class ContentCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Содержимое кэша в другой процесс не передаём
+        return {'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_bytes'])
+
+    def get(self, key):
+        with self._lock:
+            data = self._data.get(key)
+            if data is not None:
+                self._data.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.used -= len(old)
+            self._data[key] = data
+            self.used += len(data)
+            while self.used > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.used -= len(evicted)
+
+
+def iter_bytes(data, size=CHUNK_SIZE):
+    view = memoryview(data)
+    for pos in range(0, len(view), size):
+        yield bytes(view[pos:pos + size])
+
+
+class ContentStore:
+    # Общие буферы содержимого: одинаковые файлы ссылаются на один объект bytes.
+    # Ключ — CRC32 и размер из ZIP, совпадение ключа подтверждается хешем
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.files = 0
+        self.duplicates = 0
+        self.saved = 0
+
+    def __getstate__(self):
+        # В другой процесс передаётся только статистика
+        return {'files': self.files, 'duplicates': self.duplicates, 'saved': self.saved}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.__dict__.update(state)
+
+    def intern(self, crc, data):
+        key = (crc, len(data))
+        with self._lock:
+            self.files += 1
+            entries = self._entries.get(key)
+            if entries is None:
+                # Хеш считается только при первом совпадении ключа
+                self._entries[key] = [[data, None]]
+                return data
+        digest = hashlib.blake2b(data).digest()
+        with self._lock:
+            for entry in entries:
+                if entry[1] is None:
+                    entry[1] = hashlib.blake2b(entry[0]).digest()
+                if entry[1] == digest:
+                    self.duplicates += 1
+                    self.saved += len(data)
+                    return entry[0]
+            entries.append([data, digest])
+            return data
+
+    def release(self):
+        # После загрузки таблица буферов не нужна, остаётся только статистика
+        self._entries = {}
+
+
+class ZipSource:
+    def __init__(self, zip_path, cache=None):
+        self.path = zip_path
+        self.cache = cache
+        self._zip = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'path': self.path, 'cache': self.cache}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['cache'])
+
+    def _open(self):
+        with self._lock:
+            # После fork дескриптор с общей позицией чтения использовать нельзя
+            if self._zip is None or self._pid != os.getpid():
+                self._zip = zipfile.ZipFile(self.path, 'r')
+                self._pid = os.getpid()
+            return self._zip
+
+    def read(self, info):
+        if self.cache is not None:
+            data = self.cache.get(info.header_offset)
+            if data is not None:
+                return data
+        data = self._open().read(info)
+        if self.cache is not None:
+            self.cache.put(info.header_offset, data)
+        return data
+
+    def iter_chunks(self, info, size=CHUNK_SIZE):
+        # Файлы, помещающиеся в кэш, читаются целиком через read() и попадают в кэш;
+        # больше лимита — распаковываются потоком и не кэшируются
+        if self.cache is not None and info.file_size <= self.cache.max_bytes:
+            yield from iter_bytes(self.read(info), size)
+            return
+        with self._open().open(info) as f:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def close(self):
+        with self._lock:
+            if self._zip is not None:
+                self._zip.close()
+                self._zip = None
+
+
+class ZipMember:
+    # Содержимое файла, которое распаковывается только при обращении
+    __slots__ = ('source', 'info')
+
+    def __init__(self, source, info):
+        self.source = source
+        self.info = info
+
+    def __len__(self):
+        return self.info.file_size
+
+    def read(self):
+        return self.source.read(self.info)
+
+    def chunks(self, size=CHUNK_SIZE):
+        return self.source.iter_chunks(self.info, size)
+
+    def zip_origin(self):
+        return self.source.path, self.info
+
+
+class DirNode:
+    # ndirs, nfiles, size — число подкаталогов, файлов и суммарный размер файлов
+    # непосредственно в этом каталоге; поддерживаются при каждом изменении children.
+    # total — размер всего поддерева, его поддерживает VFS (compute_totals, move)
+    __slots__ = ('owner', 'children', 'ndirs', 'nfiles', 'size', 'total')
+
+    def __init__(self, owner='user'):
+        self.owner = sys.intern(owner)
+        self.children = {}
+        self.ndirs = 0
+        self.nfiles = 0
+        self.size = 0
+        self.total = 0
+
+    def _account(self, node, sign):
+        if isinstance(node, DirNode):
+            self.ndirs += sign
+        else:
+            self.nfiles += sign
+            self.size += sign * node.size
+
+    def add(self, name, node):
+        old = self.children.get(name)
+        if old is not None:
+            self._account(old, -1)
+        self.children[name] = node
+        self._account(node, 1)
+
+    def remove(self, name):
+        node = self.children.pop(name)
+        self._account(node, -1)
+        return node
+
+
+class FileNode:
+    # content: bytes либо ленивый объект с len(), read() и chunks() (ZipMember, данные снимка)
+    __slots__ = ('owner', 'content')
+
+    def __init__(self, content, owner='user'):
+        self.owner = sys.intern(owner)
+        self.content = content
+
+    @property
+    def size(self):
+        return len(self.content)
+
+    def read(self):
+        if isinstance(self.content, bytes):
+            return self.content
+        return self.content.read()
+
+    def chunks(self, size=CHUNK_SIZE):
+        if isinstance(self.content, bytes):
+            return iter_bytes(self.content, size)
+        return self.content.chunks(size)
+
+
+def compute_totals(root):
+    order = [root]
+    for node in order:
+        order.extend(child for child in node.children.values() if isinstance(child, DirNode))
+    for node in reversed(order):
+        node.total = node.size + sum(child.total for child in node.children.values() if isinstance(child, DirNode))
+
+
+def node_size(node):
+    return node.total if isinstance(node, DirNode) else node.size
+
+
+def path_str(parts):
+    return '/' + '/'.join(parts)
+
+
+def join_path(parent, name):
+    return f"{parent}/{name}" if parent != '/' else f"/{name}"
+
+
+class PathError(Exception):
+    # component=None означает попытку подняться выше корня
+    def __init__(self, component=None):
+        super().__init__(component)
+        self.component = component
+
+
+class VFS:
+    def __init__(self, root, source=None, index=None, zip_source=None, lookup_cache_size=4096):
+        self.root = root
+        # Путь к ZIP, из которого загружено дерево, и его открытый ZipSource в ленивом режиме
+        self.source = source
+        self.zip_source = zip_source
+        # Есть ли изменения (mv, chown), не сохранённые в ZIP
+        self.modified = False
+        # ContentStore загрузчика со статистикой дедупликации содержимого
+        self.dedup = None
+        # Плоский индекс: абсолютный путь -> узел, и индекс имён: имя -> множество путей
+        self.index = {} if index is None else index
+        self.names = {}
+        # Обратный индекс узел -> путь, строится при первом path_of (горячая перезагрузка)
+        self.node_paths = None
+        if index is None:
+            self._index_subtree('/', root)
+        else:
+            for path in index:
+                if path != '/':
+                    self._add_name(path)
+        self.lookup_cache_size = lookup_cache_size
+        self._lookup_cache = OrderedDict()
+        # Число узлов, пройденных при разрешении путей (для --profile и time)
+        self.visited = 0
+        # Отсортированные имена каталогов для автодополнения, строятся при первом обращении
+        self._sorted_names = {}
+        # Для горячей перезагрузки: записи архива (имя -> CRC, размер, узел) и его stat.
+        # Неявные каталоги (без своей записи) хранятся с CRC None
+        self.zip_entries = None
+        self.source_stat = None
+
+    def _index_subtree(self, path, node):
+        stack = [(sys.intern(path), node)]
+        while stack:
+            path, node = stack.pop()
+            self.index[path] = node
+            if self.node_paths is not None:
+                self.node_paths[node] = path
+            if path != '/':
+                self._add_name(path)
+            if isinstance(node, DirNode):
+                for name, child in node.children.items():
+                    stack.append((sys.intern(join_path(path, name)), child))
+
+    def _unindex_subtree(self, path, node):
+        stack = [(path, node)]
+        while stack:
+            path, node = stack.pop()
+            del self.index[path]
+            if self.node_paths is not None:
+                self.node_paths.pop(node, None)
+            self._discard_name(path)
+            if isinstance(node, DirNode):
+                for name, child in node.children.items():
+                    stack.append((join_path(path, name), child))
+
+    def _add_name(self, path):
+        self.names.setdefault(path.rpartition('/')[2], set()).add(path)
+
+    def _discard_name(self, path):
+        name = path.rpartition('/')[2]
+        paths = self.names[name]
+        paths.discard(path)
+        if not paths:
+            del self.names[name]
+
+    def _named(self, name):
+        return self.names.get(name, ())
+
+    def _all_names(self):
+        return self.names
+
+    def get(self, parts):
+        return self.index[path_str(parts)]
+
+    def path_of(self, node):
+        # Текущие части пути узла или None, если узла в дереве нет
+        if self.node_paths is None:
+            self.node_paths = {n: path for path, n in self.index.items()}
+        path = self.node_paths.get(node)
+        if path is None:
+            return None
+        return tuple(path.split('/')[1:]) if path != '/' else ()
+
+    def resolve(self, cwd, target, clamp=False):
+        # Возвращает (путь, узел) каталога; clamp=True игнорирует '..' в корне
+        key = (cwd, target, clamp)
+        cached = self._lookup_cache.get(key)
+        if cached is not None:
+            self._lookup_cache.move_to_end(key)
+            return cached
+
+        if target.startswith('/'):
+            path = []
+            parts = target.strip('/').split('/')
+        else:
+            path = list(cwd)
+            parts = target.split('/')
+
+        node = None
+        if not path and '..' not in parts and '.' not in parts:
+            path = [p for p in parts if p]
+            node = self.index.get(path_str(path))
+            self.visited += 1
+            if not isinstance(node, DirNode):
+                path, node = [], None
+        if node is None:
+            node = self.get(path)
+            self.visited += 1
+            for p in parts:
+                if p == '' or p == '.':
+                    continue
+                elif p == '..':
+                    if path:
+                        path.pop()
+                        node = self.get(path)
+                        self.visited += 1
+                    elif not clamp:
+                        raise PathError()
+                else:
+                    node = node.children.get(p)
+                    self.visited += 1
+                    if not isinstance(node, DirNode):
+                        raise PathError(p)
+                    path.append(p)
+
+        result = (tuple(path), node)
+        self._lookup_cache[key] = result
+        if len(self._lookup_cache) > self.lookup_cache_size:
+            self._lookup_cache.popitem(last=False)
+        return result
+
+    def _adjust_totals(self, parts, delta):
+        for i in range(len(parts) + 1):
+            self.get(parts[:i]).total += delta
+
+    def add_node(self, parent_parts, name, node):
+        parent = self.get(parent_parts)
+        name = sys.intern(name)
+        parent.add(name, node)
+        names = self._sorted_names.get(parent)
+        if names is not None:
+            insort(names, name)
+        # Размеры поддеревьев меняются только у предков
+        self._adjust_totals(parent_parts, node_size(node))
+        self._index_subtree(join_path(path_str(parent_parts), name), node)
+        self._lookup_cache.clear()
+
+    def remove_node(self, parent_parts, name):
+        parent = self.get(parent_parts)
+        node = parent.remove(name)
+        names = self._sorted_names.get(parent)
+        if names is not None:
+            del names[bisect_left(names, name)]
+        self._adjust_totals(parent_parts, -node_size(node))
+        self._unindex_subtree(join_path(path_str(parent_parts), name), node)
+        self._lookup_cache.clear()
+        return node
+
+    def set_content(self, parts, content):
+        node = self.get(parts)
+        delta = len(content) - node.size
+        node.content = content
+        self.get(parts[:-1]).size += delta
+        self._adjust_totals(parts[:-1], delta)
+
+    def move(self, src_parent, src_name, dst_parent, dst_name):
+        # Переиндексируется только перемещённое поддерево
+        node = self.remove_node(src_parent, src_name)
+        self.add_node(dst_parent, dst_name, node)
+        self.modified = True
+
+    def complete_names(self, node, prefix):
+        # Имена каталога с заданным префиксом: двоичный поиск по отсортированному списку
+        names = self._sorted_names.get(node)
+        if names is None:
+            names = self._sorted_names[node] = sorted(node.children)
+        start = bisect_left(names, prefix)
+        end = bisect_left(names, prefix + '\U0010ffff', start)
+        return names[start:end]
+
+    def walk(self, path):
+        # Пути поддерева в прямом порядке обхода
+        stack = [(path, self.index[path])]
+        while stack:
+            path, node = stack.pop()
+            yield path, node
+            if isinstance(node, DirNode):
+                children = [(join_path(path, name), child) for name, child in node.children.items()]
+                stack.extend(reversed(children))
+
+    def find(self, path, pattern):
+        # Через индекс имён: просматриваются только пути с подходящим именем
+        if any(c in pattern for c in '*?['):
+            match = re.compile(fnmatch.translate(pattern)).match
+            names = [name for name in self._all_names() if match(name)]
+        else:
+            names = [pattern]
+        prefix = path if path == '/' else path + '/'
+        found = []
+        for name in names:
+            for p in self._named(name):
+                if p == path or p.startswith(prefix):
+                    found.append(p)
+        found.sort()
+        return found
+
+    def chown(self, parts, owner):
+        self.get(parts).owner = sys.intern(owner)
+        self.modified = True
+
+
+class OverlayIndex:
+    # Индекс путей поверх общего индекса: свои записи плюс удалённые пути (tombstones)
+    def __init__(self, base):
+        self.base = base
+        self.added = {}
+        self.removed = set()
+
+    def __getitem__(self, path):
+        node = self.added.get(path)
+        if node is not None:
+            return node
+        if path in self.removed:
+            raise KeyError(path)
+        return self.base[path]
+
+    def get(self, path, default=None):
+        try:
+            return self[path]
+        except KeyError:
+            return default
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    def __setitem__(self, path, node):
+        self.added[path] = node
+        self.removed.discard(path)
+
+    def __delitem__(self, path):
+        if self.added.pop(path, None) is None and path not in self.base:
+            raise KeyError(path)
+        if path in self.base:
+            self.removed.add(path)
+
+    def __iter__(self):
+        for path in self.base:
+            if path not in self.removed and path not in self.added:
+                yield path
+        yield from self.added
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def items(self):
+        return ((path, self[path]) for path in self)
+
+    def values(self):
+        return [self[path] for path in self]
+
+
+class OverlayVFS(VFS):
+    # Копия VFS при записи: общее неизменяемое дерево base и собственные изменения сессии.
+    # Изменяемые каталоги копируются вместе с путём от корня, остальное дерево общее,
+    # поэтому память растёт пропорционально изменениям, а не размеру архива
+    def __init__(self, base, lookup_cache_size=4096):
+        self.base = base
+        self.root = base.root
+        self.source = base.source
+        self.zip_source = base.zip_source
+        self.modified = False
+        self.dedup = base.dedup
+        self.index = OverlayIndex(base.index)
+        self.names_added = {}
+        self.names_removed = set()
+        self._owned = set()
+        self.lookup_cache_size = lookup_cache_size
+        self._lookup_cache = OrderedDict()
+        self.visited = 0
+        self._sorted_names = {}
+        self.node_paths = None
+        self.zip_entries = None
+        self.source_stat = None
+
+    def _add_name(self, path):
+        self.names_removed.discard(path)
+        name = path.rpartition('/')[2]
+        if path not in self.base._named(name):
+            self.names_added.setdefault(name, set()).add(path)
+
+    def _discard_name(self, path):
+        name = path.rpartition('/')[2]
+        added = self.names_added.get(name)
+        if added is not None and path in added:
+            added.discard(path)
+            if not added:
+                del self.names_added[name]
+        if path in self.base._named(name):
+            self.names_removed.add(path)
+
+    def _named(self, name):
+        paths = [p for p in self.base._named(name) if p not in self.names_removed]
+        paths.extend(self.names_added.get(name, ()))
+        return paths
+
+    def _all_names(self):
+        return set(self.base._all_names()) | set(self.names_added)
+
+    def _copy_dir(self, node):
+        copy = DirNode(node.owner)
+        copy.children = dict(node.children)
+        copy.ndirs, copy.nfiles, copy.size, copy.total = node.ndirs, node.nfiles, node.size, node.total
+        self._owned.add(copy)
+        # Кэш поиска мог вернуть каталоги общего дерева
+        self._lookup_cache.clear()
+        return copy
+
+    def _own(self, parts):
+        # Копирует каталоги от корня до parts, которые ещё принадлежат общему дереву
+        if self.root not in self._owned:
+            self.root = self._copy_dir(self.root)
+            self.index['/'] = self.root
+        node = self.root
+        path = '/'
+        for p in parts:
+            child = node.children[p]
+            path = join_path(path, p)
+            if child not in self._owned:
+                child = self._copy_dir(child)
+                node.children[p] = child
+                self.index[path] = child
+            node = child
+        return node
+
+    def move(self, src_parent, src_name, dst_parent, dst_name):
+        self._own(src_parent)
+        self._own(dst_parent)
+        super().move(src_parent, src_name, dst_parent, dst_name)
+
+    def chown(self, parts, owner):
+        node = self.get(parts)
+        if isinstance(node, DirNode):
+            self._own(parts).owner = sys.intern(owner)
+        else:
+            parent = self._own(parts[:-1])
+            node = FileNode(node.content, owner)
+            parent.children[parts[-1]] = node
+            self.index[path_str(parts)] = node
+        self.modified = True
+
+
+def source_stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+class ThreadZipFiles:
+    # У каждого потока свой ZipFile: общий дескриптор пришлось бы читать под блокировкой
+    def __init__(self, zip_path):
+        self.zip_path = zip_path
+        self._local = threading.local()
+        self._opened = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        z = getattr(self._local, 'zip', None)
+        if z is None:
+            z = self._local.zip = zipfile.ZipFile(self.zip_path, 'r')
+            with self._lock:
+                self._opened.append(z)
+        return z
+
+    def close(self):
+        for z in self._opened:
+            z.close()
+
+
+def _read_batch(zips, store, batch):
+    z = zips.get()
+    for node, info in batch:
+        node.content = store.intern(info.CRC, z.read(info))
+
+
+def load_vfs_from_zip(zip_path, lazy=False, cache_size=0, threads=1):
+    if not zip_path or not os.path.exists(zip_path):
+        print(f"VFS не найден: {zip_path}")
+        return None
+    root = DirNode()
+    source = None
+    if lazy:
+        source = ZipSource(zip_path, ContentCache(cache_size) if cache_size > 0 else None)
+
+    # Параллельная загрузка: пока основной поток строит дерево по infolist(),
+    # пул потоков распаковывает файлы пакетами (zlib отпускает GIL)
+    stat = source_stat(zip_path)
+    entries = {}
+    store = ContentStore() if not lazy else None
+    pool = zips = None
+    futures = []
+    batch = []
+    batch_bytes = 0
+    if not lazy and threads > 1:
+        pool = ThreadPoolExecutor(max_workers=threads)
+        zips = ThreadZipFiles(zip_path)
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as z:
+            for info in z.infolist():
+                parts = info.filename.strip('/').split('/')
+                ref = root
+                for depth, p in enumerate(parts[:-1], 1):
+                    child = ref.children.get(p)
+                    if child is None:
+                        child = DirNode()
+                        ref.add(sys.intern(p), child)
+                        entries['/'.join(parts[:depth]) + '/'] = (None, 0, child)
+                    elif not isinstance(child, DirNode):
+                        raise ValueError(f"Конфликт: {p} уже существует как файл")
+                    ref = child
+                last = sys.intern(parts[-1])
+                owner = zip_owner(info.extra) if info.extra else 'user'
+
+                if info.is_dir():
+                    node = ref.children.get(last)
+                    if node is None:
+                        node = DirNode(owner)
+                        ref.add(last, node)
+                    elif isinstance(node, DirNode):
+                        node.owner = sys.intern(owner)
+                elif pool is not None:
+                    # До распаковки размер файла берётся из заголовка через ZipMember
+                    node = FileNode(ZipMember(None, info), owner)
+                    ref.add(last, node)
+                    batch.append((node, info))
+                    batch_bytes += info.compress_size
+                    if len(batch) >= LOAD_BATCH_FILES or batch_bytes >= LOAD_BATCH_BYTES:
+                        futures.append(pool.submit(_read_batch, zips, store, batch))
+                        batch = []
+                        batch_bytes = 0
+                else:
+                    if lazy:
+                        content = ZipMember(source, info)
+                    else:
+                        content = store.intern(info.CRC, z.read(info))
+                    node = FileNode(content, owner)
+                    ref.add(last, node)
+                entries[info.filename] = (info.CRC, info.file_size, node)
+            if batch:
+                futures.append(pool.submit(_read_batch, zips, store, batch))
+            for future in futures:
+                future.result()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+            zips.close()
+    compute_totals(root)
+    vfs = VFS(root, source=zip_path, zip_source=source)
+    vfs.zip_entries = entries
+    vfs.source_stat = stat
+    if store is not None:
+        store.release()
+        vfs.dedup = store
+    return vfs
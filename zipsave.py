@@ -0,0 +1,132 @@
+import os
+import time
+import struct
+import zipfile
+import zlib
+
+from vfs import DirNode, owner_extra, source_stat
+
+COPY_CHUNK = 1024 * 1024
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+
+
+def _walk(root):
+    stack = [('', root)]
+    while stack:
+        prefix, node = stack.pop()
+        for name, child in node.children.items():
+            if isinstance(child, DirNode):
+                yield prefix + name + '/', child
+                stack.append((prefix + name + '/', child))
+            else:
+                yield prefix + name, child
+
+
+def _copy_raw(out, src, info, name, extra):
+    # Копирует сжатые данные члена архива без распаковки, заголовок пишется заново
+    src.seek(info.header_offset)
+    header = LOCAL_HEADER.unpack(src.read(LOCAL_HEADER.size))
+    if header[0] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Неверный локальный заголовок: {info.filename}")
+    src.seek(info.header_offset + LOCAL_HEADER.size + header[-2] + header[-1])
+
+    zinfo = zipfile.ZipInfo(name, info.date_time)
+    zinfo.compress_type = info.compress_type
+    # Размеры известны заранее, дескриптор данных после содержимого не нужен
+    zinfo.flag_bits = info.flag_bits & ~0x08
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+    zinfo.create_system = info.create_system
+    zinfo.external_attr = info.external_attr
+    zinfo.extra = extra
+    zip64 = info.file_size > zipfile.ZIP64_LIMIT or info.compress_size > zipfile.ZIP64_LIMIT
+
+    # ZipFile сам запишет центральный каталог (с ZIP64 при необходимости)
+    # по filelist, поэтому данные пишутся в его поток напрямую
+    zinfo.header_offset = out.fp.tell()
+    out.fp.write(zinfo.FileHeader(zip64))
+    remaining = info.compress_size
+    while remaining:
+        chunk = src.read(min(COPY_CHUNK, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Архив обрезан: {info.filename}")
+        out.fp.write(chunk)
+        remaining -= len(chunk)
+    out.filelist.append(zinfo)
+    out.NameToInfo[zinfo.filename] = zinfo
+    out.start_dir = out.fp.tell()
+
+
+def save_vfs_to_zip(vfs, zip_path):
+    now = time.localtime()[:6]
+    sources = {}
+    by_checksum = None
+    source_zip = None
+    copied = packed = 0
+    # Файлы полной загрузки, содержимое которых не менялось: узел -> имя записи исходного архива.
+    # Пока архив на диске тот же, что при загрузке, такие файлы копируются без проверки
+    unchanged = {}
+    if vfs.zip_entries is not None and vfs.source and source_stat(vfs.source) == vfs.source_stat:
+        unchanged = {node: name for name, (crc, _, node) in vfs.zip_entries.items() if crc is not None}
+    tmp_path = zip_path + '.tmp'
+    try:
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as out:
+            for name, node in _walk(vfs.root):
+                extra = owner_extra(node.owner) if node.owner != 'user' else b''
+                if isinstance(node, DirNode):
+                    zinfo = zipfile.ZipInfo(name, now)
+                    zinfo.extra = extra
+                    out.writestr(zinfo, b'')
+                    continue
+
+                data = None
+                origin = None
+                if not isinstance(node.content, bytes):
+                    origin = node.content.zip_origin()
+                elif node in unchanged:
+                    if source_zip is None:
+                        source_zip = zipfile.ZipFile(vfs.source)
+                    origin = vfs.source, source_zip.getinfo(unchanged[node])
+                if origin is None and vfs.source and os.path.exists(vfs.source):
+                    # Прочее содержимое в памяти (снимок, сессия сервера) ищем в исходном архиве
+                    # по CRC и размеру, совпадение подтверждается сравнением с распакованным членом
+                    if by_checksum is None:
+                        if source_zip is None:
+                            source_zip = zipfile.ZipFile(vfs.source)
+                        by_checksum = {}
+                        for i in source_zip.infolist():
+                            if not i.is_dir():
+                                by_checksum.setdefault((i.CRC, i.file_size), []).append(i)
+                    data = node.read()
+                    for info in by_checksum.get((zlib.crc32(data), len(data)), ()):
+                        if source_zip.read(info) == data:
+                            origin = vfs.source, info
+                            break
+
+                if origin is not None:
+                    source_path, info = origin
+                    src = sources.get(source_path)
+                    if src is None:
+                        src = sources[source_path] = open(source_path, 'rb')
+                    _copy_raw(out, src, info, name, extra)
+                    copied += 1
+                else:
+                    zinfo = zipfile.ZipInfo(name, now)
+                    zinfo.extra = extra
+                    out.writestr(zinfo, node.read() if data is None else data, zipfile.ZIP_DEFLATED)
+                    packed += 1
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        for src in sources.values():
+            src.close()
+        if source_zip is not None:
+            source_zip.close()
+
+    if vfs.zip_source is not None and os.path.abspath(vfs.zip_source.path) == os.path.abspath(zip_path):
+        vfs.zip_source.close()
+    os.replace(tmp_path, zip_path)
+    return copied, packed